@@ -2,6 +2,7 @@ from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 import os
 from dotenv import load_dotenv
+from database.storage import DatabaseStorage
 
 load_dotenv()
 
@@ -9,4 +10,4 @@ TOKEN=os.getenv("BOT_TOKEN")
 ADMIN=int(os.getenv("ADMIN"))
 
 bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-dp = Dispatcher()
+dp = Dispatcher(storage=DatabaseStorage())
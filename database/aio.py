@@ -0,0 +1,54 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from database import db
+from database.backend import is_memory_sqlite
+from database.models import engine
+
+# Соединение с SQLite в памяти одно на процесс, поэтому запросы к нему выполняются в одном потоке
+DB_WORKERS = 1 if is_memory_sqlite(engine) else int(os.getenv("DB_WORKERS", 10))
+
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+
+async def run_sync(func, *args, **kwargs):
+    """Выполнение блокирующей функции в пуле потоков БД, не блокируя цикл событий"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, partial(context.run, func, *args, **kwargs))
+
+
+def offload(func):
+    """Асинхронная обертка над синхронной функцией доступа к БД"""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_sync(func, *args, **kwargs)
+    return wrapper
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
+
+
+create_book = offload(db.create_book)
+get_books = offload(db.get_books)
+get_books_page = offload(db.get_books_page)
+count_books = offload(db.count_books)
+get_language_catalog = offload(db.get_language_catalog)
+get_languages = offload(db.get_languages)
+get_count_of_languages = offload(db.get_count_of_languages)
+register_user = offload(db.register_user)
+last_booking = offload(db.last_booking)
+has_registration = offload(db.has_registration)
+reserve_book = offload(db.reserve_book)
+cancel_current_booking = offload(db.cancel_current_booking)
+expire_bookings = offload(db.expire_bookings)
+get_return_deadlines = offload(db.get_return_deadlines)
+get_author_info = offload(db.get_author_info)
+get_user_info = offload(db.get_user_info)
+get_booking_info = offload(db.get_booking_info)
+delete_record = offload(db.delete_record)
+edit_record = offload(db.edit_record)
@@ -0,0 +1,98 @@
+import csv
+import io
+import os
+from typing import Dict, List
+
+from sqlalchemy import create_engine, event, insert, Table
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import StaticPool
+
+# Пул соединений PostgreSQL: по соединению на поток database.aio и запас на пики
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# Размер кэша скомпилированных SQLAlchemy выражений
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", 1000))
+# Сколько миллисекунд SQLite ждет снятия блокировки записи
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 30000))
+
+
+def _trigrams(value: str) -> set:
+    trigrams = set()
+    for word in value.lower().split():
+        word = f"  {word} "
+        trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+
+def word_similarity(query: str, value: str) -> float:
+    """Приближение word_similarity из pg_trgm для SQLite: доля триграмм запроса, найденных в строке"""
+    if not query or not value:
+        return 0.0
+    query_trigrams = _trigrams(query)
+    if not query_trigrams:
+        return 0.0
+    return len(query_trigrams & _trigrams(value)) / len(query_trigrams)
+
+
+def _sqlite_connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL: читатели не блокируют писателя, а запись с synchronous=NORMAL не ждет fsync на каждый коммит
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.close()
+    dbapi_connection.create_function("word_similarity", 2, word_similarity, deterministic=True)
+
+
+def create_backend_engine(url: str) -> Engine:
+    """Движок под базу из URL: PostgreSQL с настроенным пулом или встроенный SQLite в режиме WAL"""
+    url = make_url(url)
+
+    if url.get_backend_name() == "sqlite":
+        options = dict(connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT / 1000})
+        if url.database in (None, "", ":memory:"):
+            # База в памяти существует, пока открыто соединение, поэтому оно одно на все потоки;
+            # database.aio для такой базы работает в одном потоке, чтобы транзакции не перемешивались
+            options["poolclass"] = StaticPool
+        engine = create_engine(url, query_cache_size=DB_STATEMENT_CACHE, **options)
+        event.listen(engine, "connect", _sqlite_connect)
+        return engine
+
+    return create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        query_cache_size=DB_STATEMENT_CACHE,
+    )
+
+
+def is_postgresql(bind) -> bool:
+    return bind.dialect.name == "postgresql"
+
+
+def is_memory_sqlite(bind) -> bool:
+    return bind.dialect.name == "sqlite" and bind.url.database in (None, "", ":memory:")
+
+
+def copy_rows(session, table: Table, rows: List[Dict]):
+    """Вставка строк через COPY FROM STDIN в PostgreSQL и многострочным INSERT в остальных базах"""
+    if not rows:
+        return
+    connection = session.connection()
+    if not is_postgresql(connection):
+        session.execute(insert(table), rows)
+        return
+
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
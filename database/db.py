@@ -1,9 +1,128 @@
-from database.models import SessionLocal, Book, Author, BookAuthor, User, Booking, BookingStatus
-from typing import List, Optional
-from datetime import date, datetime
-from sqlalchemy.orm import joinedload
-from sqlalchemy import or_
+from database.models import engine, SessionLocal, Book, Author, BookAuthor, User, Booking, BookingStatus
+from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+from collections import Counter
+from sqlalchemy import or_, and_, select, insert, update, func, cast, bindparam, literal, Float
+from utils.statistics import snapshot as statistics
+from utils.cache import TTLCache
+from utils import captions
+from database.backend import copy_rows, is_postgresql
+from database.schemas import CreatedBook, UserView, NewBooking, AuthorView, BookView, BookingView
 import logging
+import os
+
+# Кэш пользователей по user_id: UserView или None, если пользователь не зарегистрирован
+users_cache = TTLCache(maxsize=int(os.getenv("USER_CACHE_SIZE", 10000)), ttl=float(os.getenv("USER_CACHE_TTL", 600)))
+_MISSING = object()
+
+LANGUAGES_PAGE_SIZE = 5
+# Сколько дней бронь ждет получения книги
+BOOKING_DAYS = int(os.getenv("BOOKING_DAYS", 3))
+# Срок возврата взятой книги в днях
+RETURN_DAYS = int(os.getenv("RETURN_DAYS", 14))
+_language_catalog: Optional[Tuple[str, ...]] = None
+# Допустимые смены статуса брони: новый статус -> статус, из которого в него можно перейти.
+# Переходы условные (UPDATE ... WHERE status = ...), чтобы копия не вернулась в фонд дважды,
+# например после отмены просроченной брони и ее ручного перевода во "Взята" и "Возвращена"
+STATUS_TRANSITIONS = {
+    BookingStatus.PICKED_UP: BookingStatus.RESERVED,
+    BookingStatus.RETURNED: BookingStatus.PICKED_UP,
+    BookingStatus.CANCELED: BookingStatus.RESERVED,
+}
+
+def _authors_column():
+    """Имена авторов книги одной строкой: коррелированный подзапрос со string_agg или group_concat в SQLite"""
+    aggregate = func.string_agg if is_postgresql(engine) else func.group_concat
+    return (
+        select(aggregate(Author.name, ", "))
+        .select_from(BookAuthor)
+        .join(Author, Author.id == BookAuthor.author_id)
+        .where(BookAuthor.book_id == Book.id)
+        .correlate(Book)
+        .scalar_subquery()
+        .label("authors")
+    )
+
+# Колонки в порядке полей BookView, BookingView и UserView
+BOOK_COLUMNS = (Book.id, Book.title, _authors_column(), Book.language, Book.isbn, Book.isbn13, Book.num_pages,
+                Book.average_rating, Book.publication_date, Book.publisher, Book.count_in_fund)
+BOOKING_COLUMNS = (Booking.id, Booking.user_id, Booking.book_id,
+                   Booking.booking_date, Booking.booking_deadline, Booking.status)
+USER_COLUMNS = (User.user_id, User.fullname, User.age, User.phone_number)
+
+def _booking_view(row) -> BookingView:
+    """BookingView из строки BOOKING_COLUMNS + BOOK_COLUMNS [+ USER_COLUMNS]"""
+    book_start = len(BOOKING_COLUMNS)
+    user_start = book_start + len(BOOK_COLUMNS)
+    user = UserView._make(row[user_start:]) if len(row) > user_start else None
+    return BookingView(*row[:book_start], BookView._make(row[book_start:user_start]), user)
+
+# Построители запросов, общие для функций ниже и проверки планов в database/migrations.py
+
+def author_matches(author: str):
+    """Книги с подходящими авторами, по строке на книгу, и лучший ранг совпадения среди ее авторов"""
+    return (
+        select(BookAuthor.book_id, func.max(cast(func.word_similarity(author, Author.name), Float)).label("rank"))
+        .join(Author, Author.id == BookAuthor.author_id)
+        .where(Author.name.icontains(author, autoescape=True))
+        .group_by(BookAuthor.book_id)
+        .subquery()
+    )
+
+def author_ids_query(names: List[str]):
+    return select(Author.name, Author.id).where(Author.name.in_(names))
+
+def books_query(id: Optional[int] = None, title: Optional[str] = None, language: Optional[str] = None,
+                isbn: Optional[str] = None, author: Optional[str] = None):
+    query = select(*BOOK_COLUMNS)
+
+    if id:
+        query = query.where(Book.id == id)
+    elif title:
+        query = (query.where(Book.title.icontains(title, autoescape=True))
+                 .order_by(func.word_similarity(title, Book.title).desc(), Book.id))
+    elif language:
+        query = query.where(Book.language == language)
+    elif isbn:
+        query = query.where(or_(Book.isbn == isbn, Book.isbn13 == isbn))
+    elif author:
+        matches = author_matches(author)
+        query = query.join(matches, matches.c.book_id == Book.id).order_by(matches.c.rank.desc(), Book.id)
+
+    return query
+
+def last_booking_query(user_id: int):
+    return (
+        select(*BOOKING_COLUMNS, *BOOK_COLUMNS)
+        .join(Book, Book.id == Booking.book_id)
+        .where(Booking.user_id == user_id)
+        .order_by(Booking.id.desc())
+        .limit(1)
+    )
+
+def booking_info_query(id: Optional[int] = None, phone: Optional[int] = None, isbn: Optional[str] = None):
+    query = (
+        select(*BOOKING_COLUMNS, *BOOK_COLUMNS, *USER_COLUMNS)
+        .join(Book, Book.id == Booking.book_id)
+        .join(User, User.user_id == Booking.user_id)
+    )
+
+    if id:
+        query = query.where(Booking.id == id)
+    elif phone:
+        query = query.where(User.phone_number == phone).order_by(Booking.booking_date.desc())
+    elif isbn:
+        query = query.where(or_(Book.isbn == isbn, Book.isbn13 == isbn)).order_by(Booking.booking_date.desc())
+
+    return query.limit(1)
+
+def overdue_bookings_query(now: datetime, batch_size: int):
+    return (
+        select(Booking.id)
+        .where(Booking.status == BookingStatus.RESERVED, Booking.booking_deadline < now)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
 
 def create_book(
         title: str,
@@ -15,62 +134,129 @@ def create_book(
         age_limit: int,
         count_in_fund: int,
         author_names: List[str],
-        average_rating: Optional[float] = None,
+        average_rating: float = 0.0,
         language: Optional[str] = None,
-        ratings_count: Optional[int] = None,
-        pick_up_count: Optional[int] = None,
-    ):
+        ratings_count: int = 0,
+        pick_up_count: int = 0,
+    ) -> CreatedBook:
+    """Добавление книги: INSERT ... RETURNING для книги и новых авторов, авторы ищутся одним запросом"""
 
     db = SessionLocal()
 
     try:
-        book = Book(
-            title=title, 
-            average_rating=average_rating, 
-            isbn=isbn, 
-            isbn13=isbn13, 
-            language=language, 
-            age_limit=age_limit,
-            num_pages=num_pages, 
-            ratings_count=ratings_count, 
-            pick_up_count=pick_up_count, 
-            publisher=publisher, 
-            publication_date=publication_date,
-            count_in_fund=count_in_fund
-            )
-        db.add(book)
-        db.flush()
-
-        for name in author_names:
-            author = db.query(Author).filter(Author.name == name).first()
-            
-            if not author:
-                author = Author(name=name)
-                db.add(author)
-                db.flush()
-
-            exists = db.query(BookAuthor).filter_by(
-                book_id=book.id,
-                author_id=author.id
-            ).first()
-            
-            if not exists:
-                db.add(BookAuthor(book_id=book.id, author_id=author.id))
+        book = CreatedBook(*db.execute(
+            insert(Book).values(
+                title=title,
+                average_rating=average_rating,
+                isbn=isbn,
+                isbn13=isbn13,
+                language=language,
+                age_limit=age_limit,
+                num_pages=num_pages,
+                ratings_count=ratings_count,
+                pick_up_count=pick_up_count,
+                publisher=publisher,
+                publication_date=publication_date,
+                count_in_fund=count_in_fund,
+            ).returning(Book.id, Book.title, Book.language)
+        ).one())
+
+        names = list(dict.fromkeys(author_names))
+        if names:
+            author_ids = dict(db.execute(author_ids_query(names)).all())
+            new_names = [name for name in names if name not in author_ids]
+            if new_names:
+                author_ids.update(db.execute(
+                    insert(Author).returning(Author.name, Author.id, sort_by_parameter_order=True),
+                    [{"name": name} for name in new_names],
+                ).all())
+            db.execute(insert(BookAuthor).values([
+                {"book_id": book.id, "author_id": author_id} for author_id in dict.fromkeys(author_ids[name] for name in names)
+            ]))
 
         db.commit()
-        db.refresh(book)
+        statistics.reset()
+        if language not in (_language_catalog or ()):
+            reset_language_catalog()
 
-        logging.debug(f"Книга {book.title} успешно добавлена в базу данных")
+        logging.debug("Книга %s успешно добавлена в базу данных", book.title)
 
+        return book
 
     except Exception as e:
         db.rollback()
-        logging.error(f"Ошибка при создании книги: {str(e)}")
+        logging.error("Ошибка при создании книги: %s", e)
         raise ValueError(f"Ошибка при создании книги: {str(e)}")
     
     finally:
         db.close()
 
+def get_author_ids() -> Dict[str, int]:
+    db = SessionLocal()
+
+    try:
+        author_ids = {name: id for id, name in db.execute(select(Author.id, Author.name))}
+
+        logging.debug("Получено %s авторов", len(author_ids))
+
+        return author_ids
+
+    except Exception as e:
+        logging.error("Ошибка при получении авторов: %s", e)
+        raise ValueError(f"Ошибка при получении авторов: {str(e)}")
+
+    finally:
+        db.close()
+
+def create_books_bulk(books: List[dict], author_ids: Dict[str, int]) -> int:
+    """Пакетное добавление книг: многострочные INSERT для авторов, книг и связей, один коммит на пакет"""
+
+    if not books:
+        return 0
+
+    db = SessionLocal()
+
+    try:
+        new_names = list(dict.fromkeys(
+            name for book in books for name in book["author_names"] if name not in author_ids
+        ))
+        new_author_ids = {}
+        if new_names:
+            rows = db.execute(
+                insert(Author).returning(Author.id, Author.name, sort_by_parameter_order=True),
+                [{"name": name} for name in new_names],
+            )
+            new_author_ids = {name: id for id, name in rows}
+
+        book_ids = db.scalars(
+            insert(Book).returning(Book.id, sort_by_parameter_order=True),
+            [{key: value for key, value in book.items() if key != "author_names"} for book in books],
+        ).all()
+
+        links = []
+        for book_id, book in zip(book_ids, books):
+            for name in dict.fromkeys(book["author_names"]):
+                author_id = author_ids.get(name) or new_author_ids[name]
+                links.append({"book_id": book_id, "author_id": author_id})
+        copy_rows(db, BookAuthor.__table__, links)
+
+        db.commit()
+        author_ids.update(new_author_ids)
+        statistics.reset()
+        reset_language_catalog()
+
+        logging.debug("Пакет из %s книг успешно добавлен в базу данных", len(book_ids))
+
+        return len(book_ids)
+
+    except Exception as e:
+        db.rollback()
+        logging.error("Ошибка при пакетном добавлении книг: %s", e)
+        raise ValueError(f"Ошибка при пакетном добавлении книг: {str(e)}")
+
+    finally:
+        db.close()
+
 def get_books(
             id: Optional[int] = None,
             title: Optional[str] = None, 
@@ -81,216 +267,436 @@ def get_books(
     db = SessionLocal()
 
     try:
-        query = db.query(Book).options(joinedload(Book.authors))
+        query = books_query(id=id, title=title, language=language, isbn=isbn, author=author)
 
-        if id:
-            query = query.filter(Book.id == id)
-        elif title:
-            query = query.filter(Book.title.ilike(f"%{title}%"))
-        elif language:
-            query = query.filter(Book.language == language)
-        elif isbn:
-            query = query.filter(or_(Book.isbn == isbn,Book.isbn13 == isbn))
-        elif author:
-            query = query.join(Book.authors).filter(Author.name.ilike(f"%{author}%"))
-        
-        logging.debug(f"Книга по запросу успешно найдена")
+        books = [BookView._make(row) for row in db.execute(query)]
+
+        logging.debug("Книга по запросу успешно найдена")
 
-        return query.all()
+        return books
 
     except Exception as e:
-        logging.error(f"Ошибка при получении книги: {str(e)}")
+        logging.error("Ошибка при получении книги: %s", e)
         raise ValueError(f"Ошибка при получении книги: {str(e)}")
     
     finally:
         db.close()
 
-def get_languages(index: int):
+def _search_books(db, title: Optional[str] = None, language: Optional[str] = None,
+                  isbn: Optional[str] = None, author: Optional[str] = None):
+    """Запрос поиска книг и выражение ранга совпадения (None, если поиск без ранжирования)"""
+    query = db.query(Book)
+    rank = None
+
+    if title:
+        query = query.filter(Book.title.icontains(title, autoescape=True))
+        rank = cast(func.word_similarity(title, Book.title), Float)
+    elif language:
+        query = query.filter(Book.language == language)
+    elif isbn:
+        query = query.filter(or_(Book.isbn == isbn, Book.isbn13 == isbn))
+    elif author:
+        matches = author_matches(author)
+        query = query.join(matches, matches.c.book_id == Book.id)
+        rank = matches.c.rank
+
+    return query, rank
+
+def get_books_page(
+            cursor: Optional[list] = None,
+            backward: bool = False,
+            limit: int = 1,
+            title: Optional[str] = None,
+            language: Optional[str] = None,
+            isbn: Optional[str] = None,
+            author: Optional[str] = None
+        ) -> List[Tuple[BookView, list]]:
+    """Страница результатов поиска по ключу (ранг, id): книги после курсора или перед ним при backward"""
     db = SessionLocal()
 
     try:
-        languages = db.query(Book.language).distinct().limit(5).offset(index).all()
+        query, rank = _search_books(db, title=title, language=language, isbn=isbn, author=author)
 
-        logging.debug(f"Языки успешно получены")
+        if cursor:
+            last_rank, last_id = cursor
+            if backward:
+                condition = Book.id < last_id
+                if rank is not None:
+                    condition = or_(rank > last_rank, and_(rank == last_rank, condition))
+            else:
+                condition = Book.id > last_id
+                if rank is not None:
+                    condition = or_(rank < last_rank, and_(rank == last_rank, condition))
+            query = query.filter(condition)
+
+        query = query.with_entities(*BOOK_COLUMNS)
+        order = [Book.id.desc() if backward else Book.id.asc()]
+        if rank is not None:
+            query = query.add_columns(rank)
+            order.insert(0, rank.asc() if backward else rank.desc())
+
+        rows = query.order_by(*order).limit(limit).all()
+
+        page = []
+        for row in rows:
+            book = BookView._make(row[:len(BOOK_COLUMNS)])
+            page.append((book, [row[-1] if rank is not None else None, book.id]))
+
+        if backward:
+            page.reverse()
+
+        logging.debug("Страница результатов поиска успешно получена")
+
+        return page
 
-        return languages
-    
     except Exception as e:
-        logging.error(f"Ошибка при получении языков: {str(e)}")
-        raise ValueError(f"Ошибка при получении языков: {str(e)}")
-    
+        logging.error("Ошибка при получении книги: %s", e)
+        raise ValueError(f"Ошибка при получении книги: {str(e)}")
+
     finally:
         db.close()
 
-def get_count_of_languages():
+def count_books(
+            title: Optional[str] = None,
+            language: Optional[str] = None,
+            isbn: Optional[str] = None,
+            author: Optional[str] = None
+        ) -> int:
     db = SessionLocal()
 
     try:
-        count = db.query(Book.language).distinct().count()
+        query, _ = _search_books(db, title=title, language=language, isbn=isbn, author=author)
 
-        logging.debug(f"Количество языков успешно получено")
+        count = query.count()
+
+        logging.debug("Количество результатов поиска успешно получено")
 
         return count
-    
+
     except Exception as e:
-        logging.error(f"Ошибка при получении количества языков: {str(e)}")
-        raise ValueError(f"Ошибка при получении количества языков: {str(e)}")
-    
+        logging.error("Ошибка при подсчете книг: %s", e)
+        raise ValueError(f"Ошибка при подсчете книг: {str(e)}")
+
     finally:
         db.close()
 
-def register_user(user_id: int, fullname: str, age: int, phone_number:int):
+def get_language_catalog() -> Tuple[str, ...]:
+    """Отсортированный список языков изданий, загружается один раз и хранится в памяти"""
+    global _language_catalog
+
+    catalog = _language_catalog
+    if catalog is not None:
+        return catalog
+
     db = SessionLocal()
 
     try:
-        user = User(
-                user_id=user_id,
-                fullname=fullname,
-                age=age,
-                phone_number=phone_number
-            )
-        db.add(user)
+        catalog = tuple(db.scalars(
+            select(Book.language).distinct().where(Book.language.isnot(None)).order_by(Book.language)
+        ))
+        _language_catalog = catalog
+
+        logging.debug("Каталог языков успешно загружен")
+
+        return catalog
+
+    except Exception as e:
+        logging.error("Ошибка при получении языков: %s", e)
+        raise ValueError(f"Ошибка при получении языков: {str(e)}")
+
+    finally:
+        db.close()
+
+def reset_language_catalog():
+    global _language_catalog
+    _language_catalog = None
+
+def get_languages(index: int):
+    return [(language,) for language in get_language_catalog()[index:index + LANGUAGES_PAGE_SIZE]]
+
+def get_count_of_languages():
+    return len(get_language_catalog())
+
+def register_user(user_id: int, fullname: str, age: int, phone_number:int) -> UserView:
+    db = SessionLocal()
+
+    try:
+        user = UserView(*db.execute(
+            insert(User)
+            .values(user_id=user_id, fullname=fullname, age=age, phone_number=phone_number)
+            .returning(*USER_COLUMNS)
+        ).one())
         db.commit()
-        db.refresh(user)
+        users_cache.invalidate(user_id)
 
-        logging.debug(f"Пользователь {user_id} успешно добавлена в базу данных")
+        logging.debug("Пользователь %s успешно добавлена в базу данных", user_id)
+
+        return user
     
     except Exception as e:
         db.rollback()
-        logging.error(f"Ошибка при регистрации пользователя: {str(e)}")
+        logging.error("Ошибка при регистрации пользователя: %s", e)
         raise ValueError(f"Ошибка при регистрации пользователя: {str(e)}")
     
     finally:
         db.close()
 
-def last_booking(user_id: int):
+def last_booking(user_id: int) -> Optional[BookingView]:
     db = SessionLocal()
 
     try:
-        booking = (db.query(Booking).options(
-        joinedload(Booking.book).joinedload(Book.authors))
-        .filter(Booking.user_id == user_id).order_by(Booking.id.desc()).first())
+        row = db.execute(last_booking_query(user_id)).first()
+        booking = _booking_view(row) if row else None
 
-        logging.debug(f"Крайнее бронирование пользователя {user_id} успешно получено")
+        logging.debug("Крайнее бронирование пользователя %s успешно получено", user_id)
 
         return booking
 
     except Exception as e:
-        logging.error(f"Ошибка при получении крайнего бронирования: {str(e)}")
+        logging.error("Ошибка при получении крайнего бронирования: %s", e)
         raise ValueError(f"Ошибка при получении крайнего бронирования: {str(e)}")
     
     finally:
         db.close()
 
 def has_registration(user_id: int):
+    cached = users_cache.get(user_id, _MISSING)
+    if cached is not _MISSING:
+        return cached is not None
+
     db = SessionLocal()
 
     try:
-        exists = db.query(User).filter(User.user_id == user_id).first()
+        row = db.execute(select(*USER_COLUMNS).where(User.user_id == user_id)).first()
+        user = UserView._make(row) if row else None
+        users_cache.set(user_id, user)
 
-        logging.debug(f"Поиск пользователя {user_id} в Users")
+        logging.debug("Поиск пользователя %s в Users", user_id)
 
-        return exists is not None
+        return user is not None
     
     except Exception as e:
-        logging.error(f"Ошибка при проверке регистрации: {str(e)}")
+        logging.error("Ошибка при проверке регистрации: %s", e)
         raise ValueError(f"Ошибка при проверке регистрации: {str(e)}")
     
     finally:
         db.close()
 
-def reserve_book(user_id: int, book_id: int):
+def reserve_book(user_id: int, book_id: int) -> Optional[NewBooking]:
+    """Бронирование: списание экземпляра и создание брони, в PostgreSQL одним запросом"""
     db = SessionLocal()
 
     try:
-        book = db.query(Book).filter(Book.id == book_id).first()
-        
-        if book.is_available():
-            booking = Booking(
-                user_id=user_id,
-                book_id=book_id,
-                booking_date = datetime.now()
-            )
-            booking.set_booking_deadline(days=3)
-
-            db.add(booking)
-            db.flush()
+        booking_date = datetime.now()
+        values = dict(
+            user_id=user_id,
+            book_id=book_id,
+            booking_date=booking_date,
+            booking_deadline=booking_date + timedelta(days=BOOKING_DAYS),
+            status=BookingStatus.RESERVED,
+        )
+        reserve = (
+            update(Book)
+            .where(Book.id == book_id, Book.count_in_fund > 0)
+            .values(count_in_fund=Book.count_in_fund - 1)
+            .returning(Book.id)
+        )
+        returning = (Booking.id, Booking.user_id, Booking.book_id,
+                     Booking.booking_date, Booking.booking_deadline, Booking.status)
+
+        if is_postgresql(db.get_bind()):
+            # WITH reserved AS (UPDATE books ... RETURNING id) INSERT INTO bookings SELECT ... FROM reserved
+            reserved = reserve.cte("reserved")
+            columns = Booking.__table__.c
+            row = db.execute(
+                insert(Booking)
+                .from_select(list(values), select(*(literal(value, columns[key].type) for key, value in values.items()))
+                             .select_from(reserved))
+                .add_cte(reserved)
+                .returning(*returning)
+            ).first()
+        else:
+            row = None
+            if db.execute(reserve).first() is not None:
+                row = db.execute(insert(Booking).values(**values).returning(*returning)).first()
 
-            booking.book.count_in_fund -= 1
+        if row is None:
+            db.rollback()
+            return None
 
-            db.commit()
-            db.refresh(booking)
+        db.commit()
+        booking = NewBooking(*row)
+        statistics.booking_created(book_id, booking.booking_date)
 
-            logging.debug(f"Бронирование {booking.id} успешно создано")
+        logging.debug("Бронирование %s успешно создано", booking.id)
 
-            return booking
-        else:
-            return None
+        return booking
     
     except Exception as e:
         db.rollback()
-        logging.error(f"Ошибка при создании бронирования: {str(e)}")
+        logging.error("Ошибка при создании бронирования: %s", e)
         raise ValueError(f"Ошибка при создании бронирования: {str(e)}")
     
     finally:
         db.close()
 
-def cancel_current_booking(booking: Booking):
+def cancel_current_booking(booking: BookingView):
     db = SessionLocal()
     try:
-        db.add(booking)
-        booking.cancel()
+        canceled = db.execute(
+            update(Booking)
+            .where(Booking.id == booking.id, Booking.status == BookingStatus.RESERVED)
+            .values(status=BookingStatus.CANCELED)
+            .returning(Booking.book_id)
+        ).first()
+
+        if canceled:
+            db.execute(update(Book).where(Book.id == canceled.book_id).values(count_in_fund=Book.count_in_fund + 1))
         db.commit()
+        if canceled:
+            statistics.booking_canceled(canceled.book_id)
 
-        logging.debug(f"Бронировани успешно отменено")
+        logging.debug("Бронировани успешно отменено")
     except Exception as e:
         db.rollback()
-        logging.error(f"Ошибка отмены брони: {e}")
+        logging.error("Ошибка отмены брони: %s", e)
         raise ValueError(f"Ошибка отмены брони: {str(e)}")
     finally:
         db.close()
 
-def get_author_info(id: Optional[int] = None, name: Optional[str] = None):
+def expire_bookings(batch_size: int = 500) -> List[Tuple[int, str]]:
+    """Отмена просроченных броней пакетами с возвратом копий в фонд, возвращает (user_id, название книги)"""
+    db = SessionLocal()
+    books = Book.__table__
+    expired = []
+
+    try:
+        now = datetime.now()
+        while True:
+            overdue = overdue_bookings_query(now, batch_size)
+            rows = db.execute(
+                update(Booking)
+                .where(Booking.id.in_(overdue.scalar_subquery()))
+                .values(status=BookingStatus.CANCELED)
+                .returning(Booking.user_id, Booking.book_id)
+                .execution_options(synchronize_session=False)
+            ).all()
+
+            if not rows:
+                break
+
+            released = Counter(book_id for _, book_id in rows)
+            db.execute(
+                books.update()
+                .where(books.c.id == bindparam("released_book_id"))
+                .values(count_in_fund=books.c.count_in_fund + bindparam("released")),
+                [{"released_book_id": book_id, "released": count} for book_id, count in released.items()],
+            )
+            titles = dict(db.execute(select(Book.id, Book.title).where(Book.id.in_(released))).all())
+            db.commit()
+
+            for book_id, count in released.items():
+                for _ in range(count):
+                    statistics.booking_canceled(book_id)
+            expired.extend((user_id, titles.get(book_id)) for user_id, book_id in rows)
+
+            if len(rows) < batch_size:
+                break
+
+        if expired:
+            logging.debug("Отменено %s просроченных броней", len(expired))
+
+        return expired
+
+    except Exception as e:
+        db.rollback()
+        logging.error("Ошибка отмены просроченных броней: %s", e)
+        raise ValueError(f"Ошибка отмены просроченных броней: {str(e)}")
+
+    finally:
+        db.close()
+
+def get_return_deadlines(booking_id: Optional[int] = None) -> List[Tuple[int, int, str, date]]:
+    """Сроки возврата взятых книг: (id бронирования, user_id, название книги, срок возврата)"""
+    db = SessionLocal()
+
+    try:
+        query = (
+            select(Booking.id, Booking.user_id, Book.title, Booking.return_deadline)
+            .join(Book, Book.id == Booking.book_id)
+            .where(Booking.status == BookingStatus.PICKED_UP, Booking.return_deadline.isnot(None))
+        )
+        if booking_id:
+            query = query.where(Booking.id == booking_id)
+
+        deadlines = [tuple(row) for row in db.execute(query)]
+
+        logging.debug("Получено %s сроков возврата", len(deadlines))
+
+        return deadlines
+
+    except Exception as e:
+        logging.error("Ошибка при получении сроков возврата: %s", e)
+        raise ValueError(f"Ошибка при получении сроков возврата: {str(e)}")
+
+    finally:
+        db.close()
+
+def get_author_info(id: Optional[int] = None, name: Optional[str] = None) -> Optional[AuthorView]:
     db = SessionLocal()
 
     try:
-        query = db.query(Author)
+        query = db.query(Author.id, Author.name)
 
         if id:
             query = query.filter(Author.id == id)
         elif name:
-            query = query.filter(Author.name.ilike(f"%{name}%"))
+            query = (query.filter(Author.name.icontains(name, autoescape=True))
+                     .order_by(func.word_similarity(name, Author.name).desc(), Author.id))
         
-        logging.debug(f"Автор по запросу успешно найден")
+        row = query.first()
 
-        return query.first()
+        logging.debug("Автор по запросу успешно найден")
+
+        return AuthorView._make(row) if row else None
 
     except Exception as e:
-        logging.error(f"Ошибка при получении автора: {str(e)}")
+        logging.error("Ошибка при получении автора: %s", e)
         raise ValueError(f"Ошибка при получении автора: {str(e)}")
     
     finally:
         db.close()
 
-def get_user_info(user_id: Optional[int] = None, name: Optional[str] = None, phone: Optional[int] = None):
+def get_user_info(user_id: Optional[int] = None, name: Optional[str] = None, phone: Optional[int] = None) -> Optional[UserView]:
+    if user_id:
+        cached = users_cache.get(user_id, _MISSING)
+        if cached is not _MISSING:
+            return cached
+
     db = SessionLocal()
 
     try:
-        query = db.query(User)
+        query = db.query(*USER_COLUMNS)
 
         if user_id:
             query = query.filter(User.user_id == user_id)
         elif name:
-            query = query.filter(User.fullname.ilike(f"%{name}%"))
+            query = (query.filter(User.fullname.icontains(name, autoescape=True))
+                     .order_by(func.word_similarity(name, User.fullname).desc(), User.user_id))
         elif phone:
             query = query.filter(User.phone_number == phone)
         
-        logging.debug(f"Пользователь по запросу успешно найден")
+        row = query.first()
+        user = UserView._make(row) if row else None
+        if user_id:
+            users_cache.set(user_id, user)
+
+        logging.debug("Пользователь по запросу успешно найден")
 
-        return query.first()
+        return user
 
     except Exception as e:
-        logging.error(f"Ошибка при получении пользователя: {str(e)}")
+        logging.error("Ошибка при получении пользователя: %s", e)
         raise ValueError(f"Ошибка при получении пользователя: {str(e)}")
     
     finally:
@@ -299,110 +705,143 @@ def get_user_info(user_id: Optional[int] = None, name: Optional[str] = None, pho
 def get_booking_info( 
                     id: Optional[int] = None, 
                     phone: Optional[int] = None, 
-                    isbn: Optional[str] = None):
+                    isbn: Optional[str] = None) -> Optional[BookingView]:
     db = SessionLocal()
 
     try:
-        query = db.query(Booking).options(joinedload(Booking.user), joinedload(Booking.book))
-        
-        if id:
-            query = query.filter(Booking.id == id)
-        
-        elif phone:
-            query = query.join(User).filter(User.phone_number == phone).order_by(Booking.booking_date.desc())
-        
-        elif isbn:
-            query = query.join(Book).filter(or_ (Book.isbn == isbn, Book.isbn13 == isbn)).order_by(Booking.booking_date.desc())
-        
-        logging.debug(f"Информация о бронировании успешно получена")
-        
-        return query.first()
+        row = db.execute(booking_info_query(id=id, phone=phone, isbn=isbn)).first()
+
+        logging.debug("Информация о бронировании успешно получена")
+
+        return _booking_view(row) if row else None
 
     except Exception as e:
-        logging.error(f"Ошибка поиска бронирования: {str(e)}")
+        logging.error("Ошибка поиска бронирования: %s", e)
         raise ValueError(f"Ошибка при получении бронирования: {str(e)}")
     
     finally:
         db.close()
 
-def delete_record(book: Optional[Book] = None, 
-                author: Optional[Author] = None, 
-                user: Optional[User] = None, 
-                booking: Optional[Booking] = None):
+def delete_record(book_id: Optional[int] = None, 
+                author_id: Optional[int] = None, 
+                user_id: Optional[int] = None, 
+                booking_id: Optional[int] = None):
     
     db = SessionLocal()
 
     try:
-        if book:
-            book = db.merge(book)
-            db.delete(book)
-            logging.debug(f"Поле книги успешно удалено")
-        elif author:
-            author = db.merge(author)
-            db.delete(author)
-            logging.debug(f"Поле автора успешно удалено")
-        elif user:
-            user = db.merge(user)
-            db.delete(user)
-            logging.debug(f"Поле пользователя успешно удалено")
-        elif booking:
-            booking = db.merge(booking)
-            db.delete(booking)
-            logging.debug(f"Поле бронирования успешно удалено")
+        if book_id:
+            db.delete(db.get(Book, book_id))
+            logging.debug("Поле книги успешно удалено")
+        elif author_id:
+            db.delete(db.get(Author, author_id))
+            logging.debug("Поле автора успешно удалено")
+        elif user_id:
+            db.delete(db.get(User, user_id))
+            logging.debug("Поле пользователя успешно удалено")
+        elif booking_id:
+            db.delete(db.get(Booking, booking_id))
+            logging.debug("Поле бронирования успешно удалено")
         db.commit()
+        if book_id:
+            reset_language_catalog()
+            captions.invalidate(book_id)
+        if book_id or booking_id or user_id:
+            # Вместе с пользователем каскадом удаляются его брони
+            statistics.reset()
+        if user_id:
+            users_cache.invalidate(user_id)
     except Exception as e:
         db.rollback()
-        logging.error(f"Ошибка удаления записи: {e}")
+        logging.error("Ошибка удаления записи: %s", e)
         raise ValueError(f"Ошибка удаления записи: {str(e)}")
     finally:
         db.close()
 
-def edit_record(book: Optional[Book] = None, 
-                author: Optional[Author] = None, 
-                user: Optional[User] = None, 
-                booking: Optional[Booking] = None,
+def edit_record(book_id: Optional[int] = None, 
+                author_id: Optional[int] = None, 
+                user_id: Optional[int] = None, 
+                booking_id: Optional[int] = None,
                 column: Optional[str] = None,
-                value: Optional[str] = None):
+                value: Optional[str] = None) -> bool:
+    """Изменение поля записи; False, если смена статуса брони недопустима из ее текущего статуса"""
     db = SessionLocal()
+    changed = True
+    released = None
 
     try:
-        if book:
-            db.add(book)
+        if book_id:
+            book = db.get(Book, book_id)
             if column == "title":
                 book.title = value
-            logging.debug(f"Значение поля {column} книги успешно изменено")
-        elif author:
-            db.add(author)
+            elif column == "language":
+                book.language = value
+            logging.debug("Значение поля %s книги успешно изменено", column)
+        elif author_id:
+            author = db.get(Author, author_id)
             if column == "name":
                 author.name = value
-            logging.debug(f"Значение поля {column} автора успешно изменено")
-        elif user:
-            db.add(user)
+            logging.debug("Значение поля %s автора успешно изменено", column)
+        elif user_id:
+            user = db.get(User, user_id)
             if column == "fullname":
                 user.fullname = value
-            logging.debug(f"Значение поля {column} пользователя успешно изменено")
-        elif booking:
-            db.add(booking)
-            db.flush()
+            logging.debug("Значение поля %s пользователя успешно изменено", column)
+        elif booking_id:
             if column == "status":
                 found_status = None
                 for status in BookingStatus:
                     if status.value.lower() == value.lower():
                         found_status = status
                         break
-                booking.status = found_status
 
-                if found_status == BookingStatus.RETURNED:
-                    booking.return_date = datetime.now()
-                    booking.book.pick_up_count += 1
-                    booking.book.count_in_fund += 1
-
-            logging.debug(f"Значение поля {column} бронирования успешно изменено")
+                values = dict(status=found_status)
+                if found_status == BookingStatus.PICKED_UP:
+                    values.update(pick_up_date=date.today(), return_deadline=date.today() + timedelta(days=RETURN_DAYS))
+                elif found_status == BookingStatus.RETURNED:
+                    values.update(return_date=datetime.now())
+
+                transition = db.execute(
+                    update(Booking)
+                    .where(Booking.id == booking_id, Booking.status == STATUS_TRANSITIONS.get(found_status))
+                    .values(**values)
+                    .returning(Booking.book_id)
+                ).first()
+                changed = transition is not None
+
+                if changed and found_status in (BookingStatus.RETURNED, BookingStatus.CANCELED):
+                    released = (found_status, transition.book_id)
+                    returned = {"pick_up_count": Book.pick_up_count + 1} if found_status == BookingStatus.RETURNED else {}
+                    db.execute(
+                        update(Book).where(Book.id == transition.book_id)
+                        .values(count_in_fund=Book.count_in_fund + 1, **returned)
+                    )
+
+            if changed:
+                logging.debug("Значение поля %s бронирования успешно изменено", column)
+            else:
+                logging.debug("Бронирование %s нельзя перевести в статус %s", booking_id, value)
         db.commit()
 
+        if book_id:
+            statistics.reset()
+            captions.invalidate(book_id)
+            if column == "language":
+                reset_language_catalog()
+        elif user_id:
+            users_cache.invalidate(user_id)
+        elif released:
+            status, released_book_id = released
+            if status == BookingStatus.RETURNED:
+                statistics.booking_returned(released_book_id)
+            else:
+                statistics.booking_canceled(released_book_id)
+
+        return changed
+
     except Exception as e:
         db.rollback()
-        logging.error(f"Ошибка изменения записи: {e}")
+        logging.error("Ошибка изменения записи: %s", e)
         raise ValueError(f"Ошибка изменения записи: {str(e)}")
     finally:
         db.close()
\ No newline at end of file
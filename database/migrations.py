@@ -0,0 +1,160 @@
+import argparse
+import logging
+from datetime import datetime
+
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, DateTime,
+    select, insert, func, text,
+)
+
+from database.backend import is_postgresql
+from database.models import engine, Base, Book, Author, BookAuthor, User, Booking, FsmState
+from database.db import (
+    author_ids_query, books_query, last_booking_query, booking_info_query, overdue_bookings_query,
+)
+
+version_metadata = MetaData()
+
+schema_version = Table(
+    "schema_version", version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200)),
+    Column("applied_at", DateTime),
+)
+
+
+def _index(model, name: str):
+    return next(index for index in model.__table__.indexes if index.name == name)
+
+
+def _create_indexes(conn, *indexes):
+    for index in indexes:
+        index.create(conn, checkfirst=True)
+
+
+def initial_schema(conn):
+    Base.metadata.create_all(conn, tables=[
+        Book.__table__, Author.__table__, BookAuthor.__table__,
+        User.__table__, Booking.__table__,
+    ])
+
+
+def search_and_lookup_indexes(conn):
+    # В базах, созданных до миграций, таблицы уже есть, и create_all не добавил в них индексы
+    if is_postgresql(conn):
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    _create_indexes(
+        conn,
+        _index(Book, "ix_books_title_trgm"),
+        _index(Author, "ix_authors_name_trgm"),
+        _index(User, "ix_users_fullname_trgm"),
+        _index(Book, "ix_books_language"),
+        _index(Author, "ix_authors_name"),
+        _index(User, "ix_users_phone_number"),
+        _index(Booking, "ix_bookings_user_id_id"),
+        _index(Booking, "ix_bookings_book_id_date"),
+        _index(Booking, "ix_bookings_status_deadline"),
+    )
+
+
+def fsm_storage(conn):
+    FsmState.__table__.create(conn, checkfirst=True)
+
+
+def drop_non_postgresql_trigram_indexes(conn):
+    # До ddl_if триграммные индексы создавались и в SQLite как обычные B-деревья
+    if is_postgresql(conn):
+        return
+    for name in ("ix_books_title_trgm", "ix_authors_name_trgm", "ix_users_fullname_trgm"):
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def zero_book_counters(conn):
+    # create_book записывал NULL в счетчики, если их не передали, вместо значений по умолчанию колонок
+    books = Book.__table__
+    for column, value in ((books.c.average_rating, 0.0), (books.c.ratings_count, 0), (books.c.pick_up_count, 0)):
+        conn.execute(books.update().where(column.is_(None)).values({column: value}))
+
+
+# (версия, описание, функция обновления) - только добавлять в конец
+MIGRATIONS = [
+    (1, "Начальная схема", initial_schema),
+    (2, "Индексы поиска и частых выборок", search_and_lookup_indexes),
+    (3, "Хранилище состояний FSM", fsm_storage),
+    (4, "Удаление триграммных индексов вне PostgreSQL", drop_non_postgresql_trigram_indexes),
+    (5, "Нулевые счетчики книг вместо NULL", zero_book_counters),
+]
+
+
+def current_version(conn) -> int:
+    schema_version.create(conn, checkfirst=True)
+    return conn.scalar(select(func.max(schema_version.c.version))) or 0
+
+
+def migrate(bind=engine) -> int:
+    """Применение недостающих миграций, каждая в своей транзакции"""
+    with bind.begin() as conn:
+        version = current_version(conn)
+
+    for number, description, upgrade in MIGRATIONS:
+        if number <= version:
+            continue
+        with bind.begin() as conn:
+            upgrade(conn)
+            conn.execute(insert(schema_version).values(
+                version=number, description=description, applied_at=datetime.now()
+            ))
+        version = number
+        logging.info("Применена миграция %s: %s", number, description)
+
+    return version
+
+
+def hot_queries():
+    """Частые запросы и индекс, которым каждый из них должен пользоваться.
+
+    Запросы собираются теми же построителями, что и в database/db.py. Значения параметров
+    заведомо редкие, чтобы план не зависел от перекоса данных в конкретной базе"""
+    return [
+        ("last_booking", "ix_bookings_user_id_id", last_booking_query(0)),
+        ("get_booking_info(phone)", "ix_users_phone_number", booking_info_query(phone=70000000000)),
+        ("get_booking_info(isbn)", "ix_bookings_book_id_date", booking_info_query(isbn="0439785960")),
+        ("get_books(language)", "ix_books_language", books_query(language="Русский")),
+        ("create_book(author)", "ix_authors_name", author_ids_query(["J.K. Rowling"])),
+        ("get_books(title)", "ix_books_title_trgm", books_query(title="potter")),
+        ("expire_bookings", "ix_bookings_status_deadline", overdue_bookings_query(datetime.now(), 500)),
+    ]
+
+
+def check_query_plans(bind=engine) -> bool:
+    """Проверка, что планы частых запросов используют индексы (только PostgreSQL)"""
+    if not is_postgresql(bind):
+        logging.warning("Проверка планов запросов поддерживается только для PostgreSQL")
+        return True
+
+    ok = True
+    with bind.connect() as conn:
+        # Запрет последовательного чтения: на маленьких таблицах планировщик иначе выбирает его даже при наличии индекса
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, index, query in hot_queries():
+            compiled = query.compile(bind, compile_kwargs={"literal_binds": True})
+            plan = "\n".join(row[0] for row in conn.exec_driver_sql(f"EXPLAIN {compiled}"))
+            if index in plan:
+                print(f"OK     {name}: {index}")
+            else:
+                ok = False
+                print(f"ОШИБКА {name}: план не использует {index}\n{plan}")
+        conn.rollback()
+
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграции схемы базы данных")
+    parser.add_argument("--check-plans", action="store_true", help="проверить планы частых запросов")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(f"Версия схемы: {migrate()}")
+    if args.check_plans:
+        raise SystemExit(0 if check_query_plans() else 1)
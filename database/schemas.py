@@ -0,0 +1,63 @@
+from datetime import date, datetime
+from typing import NamedTuple, Optional
+
+from database.models import BookingStatus
+
+
+class CreatedBook(NamedTuple):
+    id: int
+    title: str
+    language: Optional[str]
+
+
+class UserView(NamedTuple):
+    user_id: int
+    fullname: str
+    age: int
+    phone_number: int
+
+
+class NewBooking(NamedTuple):
+    id: int
+    user_id: int
+    book_id: int
+    booking_date: datetime
+    booking_deadline: datetime
+    status: BookingStatus
+
+
+# Модели чтения для карточек: кортежи без ORM-инструментации, собираются прямо из строк
+# результата и не зависят от закрытой сессии
+
+class AuthorView(NamedTuple):
+    id: int
+    name: str
+
+
+class BookView(NamedTuple):
+    id: int
+    title: str
+    # Имена авторов через запятую
+    authors: Optional[str]
+    language: Optional[str]
+    isbn: str
+    isbn13: str
+    num_pages: int
+    average_rating: Optional[float]
+    publication_date: date
+    publisher: str
+    count_in_fund: int
+
+    def is_available(self):
+        return self.count_in_fund > 0
+
+
+class BookingView(NamedTuple):
+    id: int
+    user_id: int
+    book_id: int
+    booking_date: datetime
+    booking_deadline: datetime
+    status: BookingStatus
+    book: BookView
+    user: Optional[UserView] = None
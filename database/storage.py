@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database.aio import run_sync
+from database.backend import is_postgresql
+from database.models import SessionLocal, FsmState
+from utils.cache import TTLCache
+
+# Через сколько секунд без активности диалог считается брошенным и его состояние удаляется
+FSM_TTL = float(os.getenv("FSM_TTL", 24 * 60 * 60))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", 10000))
+
+
+def _load(key: str, ttl: float) -> Tuple[Optional[str], Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        row = db.execute(select(FsmState.state, FsmState.data, FsmState.updated_at).where(FsmState.key == key)).first()
+        if row is None or row.updated_at < datetime.now() - timedelta(seconds=ttl):
+            return None, {}
+        return row.state, json.loads(row.data)
+    finally:
+        db.close()
+
+
+def _save(key: str, state: Optional[str], data: Optional[str]):
+    """Запись состояния; data - уже сериализованный JSON или None для удаления записи"""
+    db = SessionLocal()
+    try:
+        if state is None and data is None:
+            db.execute(delete(FsmState).where(FsmState.key == key))
+        else:
+            # INSERT ... ON CONFLICT DO UPDATE: одновременная первая запись одного ключа не падает на уникальности
+            insert = postgresql_insert if is_postgresql(db.get_bind()) else sqlite_insert
+            statement = insert(FsmState).values(key=key, state=state, data=data, updated_at=datetime.now())
+            db.execute(statement.on_conflict_do_update(
+                index_elements=[FsmState.key],
+                set_={name: statement.excluded[name] for name in ("state", "data", "updated_at")},
+            ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logging.error("Ошибка сохранения состояния FSM: %s", e)
+        raise
+    finally:
+        db.close()
+
+
+def _purge(ttl: float) -> int:
+    db = SessionLocal()
+    try:
+        deleted = db.execute(
+            delete(FsmState).where(FsmState.updated_at < datetime.now() - timedelta(seconds=ttl))
+        ).rowcount
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+class DatabaseStorage(BaseStorage):
+    """Хранилище FSM в таблице fsm_states с кэшем в памяти.
+
+    Данные сериализуются в JSON, поэтому в них хранятся только идентификаторы и курсоры.
+    Неизменившееся состояние не записывается, а изменения одного ключа, сделанные подряд
+    (например, set_state и set_data в FSMContext.clear), сводятся в одну запись фоновой задачей"""
+
+    def __init__(self, ttl: float = FSM_TTL, cache_size: int = FSM_CACHE_SIZE):
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_destiny=True, with_bot_id=True)
+        self._cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self._last_purge = 0.0
+        # Ключ -> (состояние, JSON данных или None) для записи и задача, которая пишет этот ключ
+        self._pending: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        self._writers: Dict[str, asyncio.Task] = {}
+
+    async def _get(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        storage_key = self.key_builder.build(key)
+        record = self._cache.get(storage_key)
+        if record is None and storage_key in self._pending:
+            # Запись вытеснена из кэша раньше, чем попала в базу
+            state, data = self._pending[storage_key]
+            record = (state, json.loads(data) if data else {})
+            self._cache.set(storage_key, record)
+        if record is None:
+            record = await run_sync(_load, storage_key, self.ttl)
+            self._cache.set(storage_key, record)
+        return record
+
+    async def _set(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        storage_key = self.key_builder.build(key)
+        if self._cache.get(storage_key) == (state, data):
+            return
+        # Сериализация здесь, чтобы несериализуемые данные падали в обработчике, а не в фоновой записи
+        serialized = json.dumps(data, ensure_ascii=False) if state is not None or data else None
+        self._cache.set(storage_key, (state, data))
+
+        self._pending[storage_key] = (state, serialized)
+        if storage_key not in self._writers:
+            self._writers[storage_key] = asyncio.create_task(self._write(storage_key))
+
+    async def _write(self, storage_key: str):
+        try:
+            while storage_key in self._pending:
+                state, data = self._pending.pop(storage_key)
+                try:
+                    await run_sync(_save, storage_key, state, data)
+                except Exception:
+                    # Ошибка уже записана в лог в _save; в кэше остается новое состояние
+                    pass
+
+            if time.monotonic() - self._last_purge > self.ttl:
+                self._last_purge = time.monotonic()
+                deleted = await run_sync(_purge, self.ttl)
+                logging.debug("Удалено %s брошенных состояний FSM", deleted)
+        except Exception as e:
+            logging.error("Ошибка удаления брошенных состояний FSM: %s", e)
+        finally:
+            del self._writers[storage_key]
+
+    async def flush(self):
+        """Ожидание записи всех изменений"""
+        while self._writers:
+            await asyncio.gather(*self._writers.values(), return_exceptions=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self._get(key)
+        await self._set(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _ = await self._get(key)
+        await self._set(key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get(key)
+        return data.copy()
+
+    async def close(self) -> None:
+        await self.flush()
@@ -8,11 +8,10 @@ from utils.keyboards import (
     keyboard_edit_book, keyboard_edit_author, 
     keyboard_edit_user, keyboard_edit_booking
 )
-from bot import bot
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from database.db import (
-    create_book, get_books, 
+from database.aio import (
+    run_sync, create_book, get_books, get_books_page,
     get_author_info, get_user_info, 
     get_booking_info, delete_record, 
     edit_record
@@ -20,7 +19,11 @@ from database.db import (
 from datetime import datetime
 from handlers.user import BOOK_PHOTO_ID
 from database.models import BookingStatus
-from utils.math import get_demand_index, calculate_balance_coefficient
+from utils.statistics import snapshot as statistics
+from utils.reminders import reminders
+from utils.delivery import outbox
+from utils.metrics import metrics
+from utils.captions import admin_book_caption, format_datetime
 from utils.validators import (
     validate_fullname, validate_int_values,
     validate_phone_number, validate_isbn,
@@ -59,6 +62,23 @@ async def cmd_admin(message: types.Message, state: FSMContext):
     await message.answer_photo(photo=PANEL_PHOTO_ID, caption="<b>Админ-панель</b>\n\nВыберите с чем будете работать", reply_markup=keyboard_admin_panel)
 
 
+@admin_router.message(Command("metrics"), F.from_user.id == ADMIN)
+async def cmd_metrics(message: types.Message):
+    """Время обработки и запросы к базе по обработчикам через /metrics"""
+    summary = metrics.summary()
+    if not summary:
+        await message.answer("Метрик пока нет")
+        return
+    # Сводка делится по целым строкам: разрезанный HTML-тег Telegram не принимает
+    chunk = []
+    for line in summary.split("\n"):
+        if chunk and len("\n".join(chunk + [line])) > 4000:
+            await message.answer("\n".join(chunk))
+            chunk = []
+        chunk.append(line)
+    await message.answer("\n".join(chunk))
+
+
 @admin_router.callback_query(F.data.startswith("crud"))
 async def edit_keyboard(call: types.CallbackQuery):
     """Изменение клавиатуры взавизимости от модели"""
@@ -187,7 +207,7 @@ async def get_age_limit(message: types.Message, state: FSMContext):
     data = await state.get_data()
     if validate_int_values(message.text):
         try:
-            create_book(title=data.get("title"),
+            await create_book(title=data.get("title"),
                         isbn=data.get("isbn"),
                         isbn13=data.get("isbn13"),
                         num_pages=data.get("num_pages"),
@@ -255,14 +275,14 @@ async def search_record(message: types.Message, state: FSMContext):
 
             if column == "id":
                 if validate_int_values(request):
-                    books = get_books(id=int(request))
+                    books = await get_books(id=int(request))
                 else:
                     error = "ID книги введено некорректно"
             elif column == "title":
-                books = get_books(title=request)
+                books = [book for book, _ in await get_books_page(title=request)]
             elif column == "isbn":
                 if validate_isbn(request):
-                    books = get_books(isbn=request)
+                    books = await get_books(isbn=request)
                 else:
                     error = "ISBN введен некорректно"
 
@@ -270,21 +290,10 @@ async def search_record(message: types.Message, state: FSMContext):
                 await message.answer(error)
             elif books:
                 book = books[0]
-                await state.update_data(book=book)
-
-                authors = ", ".join([author.name for author in book.authors]) if len(book.authors) > 1 else book.authors[0].name
+                await state.update_data(book_id=book.id)
 
                 await message.answer_photo(photo=BOOK_PHOTO_ID,
-                                    caption=f"<b>🔐 ID:</b> <code>{book.id}</code>\n\n"
-                                    f"<b>📖 Название:</b> <code>{book.title}</code>\n"
-                                    f"<b>👥 Авторы:</b> <code>{authors}</code>\n"
-                                    f"<b>🌐 Язык издания:</b> <code>{book.language}</code>\n"
-                                    f"<b>📌 ISBN(10/13):</b> <code>{book.isbn}</code> / <code>{book.isbn13}</code>\n"
-                                    f"<b>📝 Количество страниц:</b> <code>{book.num_pages}</code>\n"
-                                    f"<b>⭐ Рейтинг:</b> <code>{book.average_rating}</code>\n"
-                                    f"<b>📅 Дата публикации:</b> <code>{book.publication_date}</code>\n"
-                                    f"<b>🖨️ Издательство:</b> <code>{book.publisher}</code>\n"
-                                    f"<b>🧮 Количество в наличии:</b> <code>{book.count_in_fund}</code>\n",
+                                    caption=admin_book_caption(book),
                                     reply_markup=keyboard_edit,
                                     )
             else:
@@ -296,16 +305,16 @@ async def search_record(message: types.Message, state: FSMContext):
 
             if column == "id":
                 if validate_int_values(request):
-                    author = get_author_info(id=int(request))
+                    author = await get_author_info(id=int(request))
                 else:
                     error = "ID автора введено некорректно"
             elif column == "name":
-                author = get_author_info(name=request)
+                author = await get_author_info(name=request)
 
             if error:
                 await message.answer(error)
             elif author:
-                await state.update_data(author=author)
+                await state.update_data(author_id=author.id)
 
                 await message.answer_photo(photo=AUTHOR_PHOTO_ID,
                                     caption=f"<b>🔐 ID:</b> <code>{author.id}</code>\n\n"
@@ -321,22 +330,22 @@ async def search_record(message: types.Message, state: FSMContext):
 
             if column == "id":
                 if validate_int_values(request):
-                    user = get_user_info(user_id=int(request))
+                    user = await get_user_info(user_id=int(request))
                 else:
                     error = "ID пользователя введено некорректно"
             elif column == "name":
-                user = get_user_info(name=request)
+                user = await get_user_info(name=request)
             elif column == "phone":
                 phone=validate_phone_number(message)
                 if phone:
-                    user = get_user_info(phone=phone)
+                    user = await get_user_info(phone=phone)
                 else:
                     error = "Номер телефона пользователя введен некорректно"
 
             if error:
                 await message.answer(error)
             elif user:
-                await state.update_data(user=user)
+                await state.update_data(user_id=user.user_id)
 
                 await message.answer_photo(photo=USER_PHOTO_ID,
                                     caption=f"<b>🔐 ID:</b> <code>{user.user_id}</code>\n\n"
@@ -354,32 +363,30 @@ async def search_record(message: types.Message, state: FSMContext):
 
             if column == "id":
                 if validate_int_values(request):
-                    booking = get_booking_info(id=int(request))
+                    booking = await get_booking_info(id=int(request))
                 else:
                     error = "ID пользователя введено некорректно"
 
             elif column == "isbn":
                 if validate_isbn(request):
-                    booking = get_booking_info(isbn=request)
+                    booking = await get_booking_info(isbn=request)
                 else:
                     error = "ISBN введен некорректно"
 
             elif column == "phone":
                 phone = validate_phone_number(message)
                 if phone:
-                    booking = get_booking_info(phone=phone)
+                    booking = await get_booking_info(phone=phone)
                 else:
                     error = "Номер телефона пользователя введен некорректно"
 
             if error:
                 await message.answer(error)
             elif booking:
-                await state.update_data(booking=booking)
+                await state.update_data(booking_id=booking.id)
 
-                date = booking.booking_date
-                date = f"{str(date.day).rjust(2, '0')}.{str(date.month).rjust(2, '0')}.{date.year} {str(date.hour).rjust(2, '0')}:{str(date.minute).rjust(2, '0')}"
-                deadline = booking.booking_deadline
-                deadline = f"{str(deadline.day).rjust(2, '0')}.{str(deadline.month).rjust(2, '0')}.{deadline.year} {str(deadline.hour).rjust(2, '0')}:{str(deadline.minute).rjust(2, '0')}"
+                date = format_datetime(booking.booking_date)
+                deadline = format_datetime(booking.booking_deadline)
                 await message.answer_photo(photo=BOOKING_PHOTO_ID,
                                     caption=f"<b>🔐 ID:</b> <code>{booking.id}</code>\n\n"
                                     f"<b>📘 Книга:</b> <code>{booking.book.title}</code>\n"
@@ -402,14 +409,14 @@ async def delete_info(call: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
 
     try:
-        if data.get("book"):
-            delete_record(book=data.get("book"))
-        elif data.get("author"):
-            delete_record(author=data.get("author"))
-        elif data.get("user"):
-            delete_record(user=data.get("user"))
-        elif data.get("booking"):
-            delete_record(booking=data.get("booking"))
+        if data.get("book_id"):
+            await delete_record(book_id=data.get("book_id"))
+        elif data.get("author_id"):
+            await delete_record(author_id=data.get("author_id"))
+        elif data.get("user_id"):
+            await delete_record(user_id=data.get("user_id"))
+        elif data.get("booking_id"):
+            await delete_record(booking_id=data.get("booking_id"))
         await call.message.answer("Запись успешно удалена")
         await state.clear()
     except ValueError as e:
@@ -421,13 +428,13 @@ async def keyboard_for_edit(call: types.CallbackQuery, state: FSMContext):
     """Изменяем клавиатуру взависимости от того, какую таблицу изменяем"""
     data = await state.get_data()
 
-    if data.get("book"):
+    if data.get("book_id"):
         await call.message.edit_reply_markup(reply_markup=keyboard_edit_book)
-    elif data.get("author"):
+    elif data.get("author_id"):
         await call.message.edit_reply_markup(reply_markup=keyboard_edit_author)
-    elif data.get("user"):
+    elif data.get("user_id"):
         await call.message.edit_reply_markup(reply_markup=keyboard_edit_user)
-    elif data.get("booking"):
+    elif data.get("booking_id"):
         await call.message.edit_reply_markup(reply_markup=keyboard_edit_booking)
 
 
@@ -452,24 +459,29 @@ async def edit_message(message: types.Message, state: FSMContext):
 
     try:
         if model == "book":
-            if column == "title":
-                edit_record(book=data.get("book"), column=column, value=message.text)
+            if column in ("title", "language"):
+                await edit_record(book_id=data.get("book_id"), column=column, value=message.text)
         elif model == "author":
             if column == "name":
-                edit_record(author=data.get("author"), column=column, value=message.text)
+                await edit_record(author_id=data.get("author_id"), column=column, value=message.text)
         elif model == "user":
             if column == "fullname":
-                edit_record(user=data.get("user"), column=column, value=message.text)
+                await edit_record(user_id=data.get("user_id"), column=column, value=message.text)
         elif model == "booking":
             if column == "status":
                 found_status = validate_booking_status(message.text)
 
                 if found_status:
-                    booking=data.get("booking")
+                    booking = await get_booking_info(id=data.get("booking_id"))
                     book_id = booking.book_id
                     book_title = booking.book.title
                     user_id = booking.user_id
-                    edit_record(booking=booking, column=column, value=message.text)
+                    if not await edit_record(booking_id=booking.id, column=column, value=message.text):
+                        await message.answer(f"Бронь в статусе «{booking.status.value}» "
+                                             f"нельзя перевести в статус «{found_status.value}»")
+                        await state.clear()
+                        return
+                    await reminders.track(booking.id)
                     if found_status == BookingStatus.RETURNED:
                         keyboard_book_rating = types.InlineKeyboardMarkup(inline_keyboard=[
                             [types.InlineKeyboardButton(text="⭐️", callback_data=f"rate_book_{book_id}_1")],
@@ -478,7 +490,7 @@ async def edit_message(message: types.Message, state: FSMContext):
                             [types.InlineKeyboardButton(text="⭐️⭐️⭐️⭐️", callback_data=f"rate_book_{book_id}_4")],
                             [types.InlineKeyboardButton(text="⭐️⭐️⭐️⭐️⭐️", callback_data=f"rate_book_{book_id}_5")]
                         ])
-                        await bot.send_message(chat_id=user_id, text=f'Оцените кнгигу "{book_title}"', reply_markup=keyboard_book_rating)
+                        await outbox.send_message(user_id, f'Оцените кнгигу "{book_title}"', reply_markup=keyboard_book_rating)
                 else:
                     await message.answer("Статус бронирования введен некорректно")
         await message.answer("Запись успешно изменена")
@@ -490,14 +502,12 @@ async def edit_message(message: types.Message, state: FSMContext):
 @admin_router.callback_query(F.data == "statistics")
 async def show_statistics(call: types.CallbackQuery):
     try:
-        statistic_demand = get_demand_index()
+        top_books, coefficient = await run_sync(statistics.get, 15)
         
-        if not statistic_demand:
+        if not top_books:
             await call.message.answer("Нет данных о востребованности книг")
             return
 
-        top_books = statistic_demand[:15]
-        coefficient = calculate_balance_coefficient()
         result = f"<b>🧮 Коэффициент баланса фонда:</b> {round(coefficient, 1)}\n\n<b>📊 Топ-15 востребованных книг:</b>\n\n"
         
         for idx, book in enumerate(top_books, 1):
@@ -3,18 +3,19 @@ from aiogram.filters.command import Command
 import logging
 from utils.keyboards import (
     keyboard_menu, keyboard_search, 
-    buttons_lang_arrows, keyboard_cancel_search, 
+    keyboard_languages, keyboard_cancel_search, 
     buttons_book_arrows, keyboard_send_contact)
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from database.db import (
-    get_books, get_languages, 
-    get_count_of_languages, register_user, 
+from database.aio import (
+    get_books_page, count_books, 
+    get_language_catalog, register_user, 
     last_booking, has_registration, reserve_book, 
     cancel_current_booking
 )
 from database.models import BookingStatus
-from utils.math import add_rating
+from utils.ratings import ratings
+from utils.captions import book_caption, format_datetime
 from utils.validators import (
     validate_fullname, validate_int_values,
     validate_phone_number, validate_isbn,
@@ -35,9 +36,9 @@ class States(StatesGroup):
 @user_router.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
     """Регистрация пользователей"""
-    logging.info(f"Пользователь {message.from_user.id} начал регистрацию")
+    logging.info("Пользователь %s начал регистрацию", message.from_user.id)
 
-    if has_registration(message.from_user.id):
+    if await has_registration(message.from_user.id):
         await message.answer(f"Привет, {message.from_user.full_name}! Вы успешно прошли регистрацию и можете пользоваться ботом!")
     else:
         await message.answer(f"Привет, {message.from_user.full_name}! Перед использованием бота необходимо пройти регистрацию")
@@ -77,7 +78,7 @@ async def get_age(message: types.Message, state: FSMContext):
         age = data.get("age")
         try:
             await state.clear()
-            register_user(user_id=message.from_user.id, fullname=fullname, age=age, phone_number=phone_number)
+            await register_user(user_id=message.from_user.id, fullname=fullname, age=age, phone_number=phone_number)
             await message.answer(f"Регистрация прошла успешно теперь вам доступна команда /menu", reply_markup=types.ReplyKeyboardRemove())
         except ValueError:
             await message.answer("Возникла ошибка при регистрации")
@@ -88,17 +89,17 @@ async def get_age(message: types.Message, state: FSMContext):
 @user_router.message(Command("id"))
 async def cmd_id(message: types.Message):
     """Команда для получения id, чтобы определеить админа в .env"""
-    logging.info(f"Пользователь {message.from_user.id} использовал команду /id")
+    logging.info("Пользователь %s использовал команду /id", message.from_user.id)
     await message.answer(f"Ваш id: {message.from_user.id}")
 
 
 async def show_menu(message: types.Message):
     """Фукнция для отправки меню."""
-    if has_registration(message.from_user.id):
+    if await has_registration(message.from_user.id):
         await message.answer_photo(photo=MENU_PHOTO_ID, caption="<b>Главное меню:</b>", reply_markup=keyboard_menu)
     else:
         await message.answer("Сначала пройдите регистрацию через команду /start")
-    logging.info(f"Пользователь {message.from_user.id} запросил меню")
+    logging.info("Пользователь %s запросил меню", message.from_user.id)
 
 
 @user_router.message(Command("menu"))
@@ -132,7 +133,7 @@ async def cancel_search_inline(call: types.CallbackQuery, state: FSMContext):
 async def search_book(call: types.CallbackQuery, state: FSMContext):
     """Поиск книги"""
 
-    logging.info(f"Пользователь {call.from_user.id} начал поиск книги")
+    logging.info("Пользователь %s начал поиск книги", call.from_user.id)
 
     await state.update_data(language_index = 0)
     await call.message.edit_reply_markup(reply_markup=keyboard_search)
@@ -168,20 +169,13 @@ async def search_by_isbn(call: types.CallbackQuery, state: FSMContext):
 async def generate_keyboard_langs(message: types.Message, index: int):
     """Генерация клавиатуры для выбора языка"""
 
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[])
+    languages = ()
     try:
-        languages = get_languages(index)
-        for language in languages:
-            button_language = [types.InlineKeyboardButton(text=language[0], callback_data=f"language_{language[0]}")]
-            keyboard.inline_keyboard.insert(0, button_language)
+        languages = await get_language_catalog()
     except ValueError:
         await message.answer("Возникла ошибка при получении языков")
 
-    keyboard.inline_keyboard.append(buttons_lang_arrows)
-    cancel_button = types.InlineKeyboardButton(text="Отмена поиска", callback_data="cancel_search")
-    keyboard.inline_keyboard.append([cancel_button])
-    
-    return keyboard
+    return keyboard_languages(languages, index)
 
 
 @user_router.callback_query(F.data == "search_by_language")
@@ -191,7 +185,7 @@ async def search_by_language(call: types.CallbackQuery, state: FSMContext):
     await call.message.edit_caption(caption="<b>Выберите язык издания: </b>")
 
     data = await state.get_data()
-    index = data.get("language_index")
+    index = data.get("language_index", 0)
 
     keyboard = await generate_keyboard_langs(call.message, index)
 
@@ -204,9 +198,9 @@ async def language_arrows(call: types.CallbackQuery, state: FSMContext):
     """Перемещение между языками издания"""
 
     direction = call.data.split("_")[-1]
-    maximum = get_count_of_languages()
+    maximum = len(await get_language_catalog())
     data = await state.get_data()
-    index = data.get("language_index")
+    index = data.get("language_index", 0)
     is_changed = False
 
     if(direction == "left"):
@@ -244,46 +238,46 @@ async def show_book(message: types.Message, book):
     """Функция для отображения информации о книге"""
 
     if book != None:
-        authors = ", ".join([author.name for author in book.authors]) if len(book.authors) > 1 else book.authors[0].name
-
         keyboard = await generate_keyboard_books(book)
 
         await message.answer("<b>🔎 Вот что я нашел:</b>")
         await message.answer_photo(photo=BOOK_PHOTO_ID,
-                            caption=f"<b>📖 Название:</b> {book.title}\n"
-                            f"<b>👥 Авторы:</b> {authors}\n"
-                            f"<b>🌐 Язык издания:</b> {book.language}\n"
-                            f"<b>📌 ISBN(10/13):</b> <code>{book.isbn}</code> / <code>{book.isbn13}</code>\n"
-                            f"<b>📝 Количество страниц:</b> {book.num_pages}\n"
-                            f"<b>⭐ Рейтинг:</b> {book.average_rating}\n"
-                            f"<b>📅 Дата публикации:</b> {book.publication_date}\n"
-                            f"<b>🖨️ Издательство:</b> {book.publisher}\n",
+                            caption=book_caption(book),
                             reply_markup=keyboard,
                             )
     else:
         await message.answer("😔 <b>Ничего не нашел по вашему запросу</b>")
 
 
+async def start_search(message: types.Message, state: FSMContext, search: dict):
+    """Первая страница результатов поиска, в состоянии хранится только запрос и курсор"""
+
+    page = []
+    try:
+        count = await count_books(**search)
+        if count:
+            page = await get_books_page(**search)
+    except ValueError:
+        await message.answer("Возникла ошибка при поиске книги")
+        return
+
+    if page:
+        book, cursor = page[0]
+        await state.update_data(search=search, book_cursor=cursor, book_index=0, books_count=count)
+        await show_book(message, book)
+    else:
+        await message.answer("😔 <b>Ничего не нашел по вашему запросу</b>")
+
+
 @user_router.callback_query(F.data.startswith("language"))
 async def search_language(call: types.CallbackQuery, state: FSMContext):
     """Поиск по языку издания"""
 
-    books = None
     language = call.data.split("_")[-1]
 
-    try:
-        books = get_books(language=language)
-    except ValueError:
-        call.message.answer("Возникла ошибка при поиске книги")
+    logging.info("Пользователь %s получил результаты поиска по запросу %s", call.from_user.id, language)
 
-    logging.info(f"Пользователь {call.from_user.id} получил результаты поиска по запросу {language}")
-    
-    if len(books) != 0:
-        index = 0
-        await state.update_data(book_index=index, books=books)
-        await show_book(call.message, books[0])
-    else:
-        await call.message.answer("😔 <b>Ничего не нашел по вашему запросу</b>")
+    await start_search(call.message, state, {"language": language})
 
 
 @user_router.message(States.waiting_for_search_request)
@@ -291,30 +285,23 @@ async def search_by_request(message: types.Message, state: FSMContext):
     """Поиск по введенным данным"""
 
     data = await state.get_data()
-    books = None
-
-    try:
-        if data.get("is_search_by_name"):
-            books = get_books(title=message.text)
-        elif data.get("is_search_by_author"):
-            books = get_books(author=message.text)
-        elif data.get("is_search_by_isbn"):
-            if validate_isbn(message.text):
-                books = get_books(isbn=message.text)
-            else:
-                await message.answer("ISBN должен состоять из 10 или 13 цифр")
-        
-    except ValueError:
-        message.answer("Возникла ошибка при поиске книги")
+    search = None
+
+    if data.get("is_search_by_name"):
+        search = {"title": message.text}
+    elif data.get("is_search_by_author"):
+        search = {"author": message.text}
+    elif data.get("is_search_by_isbn"):
+        if validate_isbn(message.text):
+            search = {"isbn": message.text}
+        else:
+            await message.answer("ISBN должен состоять из 10 или 13 цифр")
+            return
 
-    logging.info(f"Пользователь {message.from_user.id} получил результаты поиска по запросу {message.text}")
+    logging.info("Пользователь %s получил результаты поиска по запросу %s", message.from_user.id, message.text)
 
-    if len(books) != 0:
-        index = 0
-        await state.update_data(book_index=index, books=books)
-        await show_book(message, books[0])
-    else:
-        await message.answer("😔 <b>Ничего не нашел по вашему запросу</b>")
+    if search:
+        await start_search(message, state, search)
 
 
 @user_router.callback_query(F.data.startswith("books"))
@@ -323,81 +310,68 @@ async def book_arrows(call: types.CallbackQuery, state: FSMContext):
 
     direction = call.data.split("_")[-1]
     data = await state.get_data()
-    books = data.get("books")
+    search = data.get("search")
+    cursor = data.get("book_cursor")
     index = data.get("book_index")
-    maximum = len(books)
+    maximum = data.get("books_count")
 
-    if(direction == "left"):
-        if(index > 0):
-            index -= 1
-    else:
-        if(index < maximum - 1):
-            index += 1
-    
-    book = books[index]
-    if book != None:
-        await state.update_data(book_index=index)
+    if search is None:
+        return
+
+    page = []
+    try:
+        if(direction == "left"):
+            if(index > 0):
+                page = await get_books_page(cursor=cursor, backward=True, **search)
+                index -= 1
+        else:
+            if(index < maximum - 1):
+                page = await get_books_page(cursor=cursor, **search)
+                index += 1
+    except ValueError:
+        await call.answer("Возникла ошибка при поиске книги", show_alert=True)
+        return
 
-        authors = ", ".join([author.name for author in book.authors]) if len(book.authors) > 1 else book.authors[0].name
+    if page:
+        book, cursor = page[0]
+        await state.update_data(book_index=index, book_cursor=cursor)
 
         keyboard = await generate_keyboard_books(book)
 
-        await call.message.edit_caption(caption=f"<b>📖 Название:</b> {book.title}\n"
-                            f"<b>👥 Авторы:</b> {authors}\n"
-                            f"<b>🌐 Язык издания:</b> {book.language}\n"
-                            f"<b>📌 ISBN(10/13):</b> <code>{book.isbn}</code> / <code>{book.isbn13}</code>\n"
-                            f"<b>📝 Количество страниц:</b> {book.num_pages}\n"
-                            f"<b>⭐ Рейтинг:</b> {book.average_rating}\n"
-                            f"<b>📅 Дата публикации:</b> {book.publication_date}\n"
-                            f"<b>🖨️ Издательство:</b> {book.publisher}\n"
-                            f"\n🔢 {index+1} из {maximum}",
+        await call.message.edit_caption(caption=book_caption(book) + f"\n🔢 {index+1} из {maximum}",
                             reply_markup=keyboard,
                             )
 
 
 @user_router.callback_query(F.data.startswith("booking"))
 async def reserve_a_book(call: types.CallbackQuery):
-    booking = last_booking(call.from_user.id)
+    booking = await last_booking(call.from_user.id)
     if validate_active_booking(booking):
         await call.answer("У вас уже есть бронь книги!", show_alert=True)
     else:
         book_id = int(call.data.split("_")[-1])
-        new_booking = reserve_book(book_id=book_id, user_id=call.from_user.id)
+        new_booking = await reserve_book(book_id=book_id, user_id=call.from_user.id)
         if new_booking:
-            deadline = new_booking.booking_deadline
-            deadline = f"{str(deadline.day).rjust(2, '0')}.{str(deadline.month).rjust(2, '0')}.{deadline.year} {str(deadline.hour).rjust(2, '0')}:{str(deadline.minute).rjust(2, '0')}"
             await call.message.answer(f"Книга успешно забронирована!\n"
-                                    f"Получите её до {deadline} в библиотеке")
+                                    f"Получите её до {format_datetime(new_booking.booking_deadline)} в библиотеке")
         else:
             await call.answer(text="Книги нет в наличии", show_alert=True)
 
 
 @user_router.callback_query(F.data == "user_booking")
 async def show_user_booking(call: types.callback_query):
-    booking = last_booking(call.from_user.id)
+    booking = await last_booking(call.from_user.id)
     if validate_active_booking(booking):
         book = booking.book
-        deadline = booking.booking_deadline
-        deadline = f"{str(deadline.day).rjust(2, '0')}.{str(deadline.month).rjust(2, '0')}.{deadline.year} {str(deadline.hour).rjust(2, '0')}:{str(deadline.minute).rjust(2, '0')}"
 
         if book != None:
-            authors = ", ".join([author.name for author in book.authors]) if len(book.authors) > 1 else book.authors[0].name
-            
             keyboard = types.InlineKeyboardMarkup(inline_keyboard=[])
             cancel_booking = [types.InlineKeyboardButton(text="❌ Отменить бронь", callback_data=f"cancel_booking")]
             keyboard.inline_keyboard.append(cancel_booking)
 
             await call.message.answer_photo(photo=BOOK_PHOTO_ID,
-                                    caption=f"<b><i>✅ Ваша бронь:</i></b>\n\n"
-                                    f"<b>📖 Название:</b> {book.title}\n"
-                                    f"<b>👥 Авторы:</b> {authors}\n"
-                                    f"<b>🌐 Язык издания:</b> {book.language}\n"
-                                    f"<b>📌 ISBN(10/13):</b> <code>{book.isbn}</code> / <code>{book.isbn13}</code>\n"
-                                    f"<b>📝 Количество страниц:</b> {book.num_pages}\n"
-                                    f"<b>⭐ Рейтинг:</b> {book.average_rating}\n"
-                                    f"<b>📅 Дата публикации:</b> {book.publication_date}\n"
-                                    f"<b>🖨️ Издательство:</b> {book.publisher}\n"
-                                    f"\n⏳ Получите до: {deadline}",
+                                    caption="<b><i>✅ Ваша бронь:</i></b>\n\n" + book_caption(book)
+                                    + f"\n⏳ Получите до: {format_datetime(booking.booking_deadline)}",
                                     reply_markup=keyboard,
                                     )
     else:
@@ -406,9 +380,9 @@ async def show_user_booking(call: types.callback_query):
 
 @user_router.callback_query(F.data == "cancel_booking")
 async def cancel_booking(call: types.callback_query):
-    current_booking = last_booking(call.from_user.id)
+    current_booking = await last_booking(call.from_user.id)
     if validate_active_booking(current_booking):
-        cancel_current_booking(current_booking)
+        await cancel_current_booking(current_booking)
         await call.answer("Бронь книги успешна отменена!", show_alert=True)
         await call.message.delete()
     else:
@@ -419,8 +393,15 @@ async def cancel_booking(call: types.callback_query):
 async def rate_book(call: types.CallbackQuery):
     book_id = int(call.data.split("_")[-2])
     rating = int(call.data.split("_")[-1])
-    add_rating(book_id, rating)
-    await call.answer("Спасибо за оценку!", show_alert=True)
+    try:
+        accepted = await ratings.submit(call.from_user.id, book_id, rating)
+    except ValueError:
+        await call.answer("Возникла ошибка при сохранении оценки", show_alert=True)
+        return
+    if accepted:
+        await call.answer("Спасибо за оценку!", show_alert=True)
+    else:
+        await call.answer("Вы уже оценили эту книгу", show_alert=True)
     await call.message.delete()
 
 
@@ -1,26 +1,57 @@
 import asyncio
 import logging
+import os
 from bot import bot, dp
+from database import aio
+from database.migrations import migrate
 
 from handlers.user import user_router
 from handlers.admin import admin_router
+from utils.webhook import run_webhook
+from utils.scheduler import expire_bookings_loop
+from utils.reminders import reminders
+from utils.delivery import outbox
+from utils.metrics import setup_metrics, start_metrics_server, METRICS_PORT
+from utils.logger import setup_logging
+from utils.ratings import ratings
+
+# polling - длинный опрос getUpdates, webhook - прием обновлений aiohttp-сервером
+BOT_MODE = os.getenv("BOT_MODE", "polling")
 
 async def main():
-    logging.basicConfig(
-        level=logging.INFO,
-        filename="logs.log",
-        #filemode="w",
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        encoding="UTF-8",
-        )
+    log_listener = setup_logging()
 
     dispatcher_logger = logging.getLogger('aiogram')
     dispatcher_logger.setLevel(logging.WARNING)
 
+    migrate()
+
     dp.include_routers(admin_router, user_router)
+    setup_metrics(dp)
 
     logging.info("Бот запущен")
-    await dp.start_polling(bot)
+    outbox.start(bot)
+    ratings.start()
+    sweeper = asyncio.create_task(expire_bookings_loop())
+    await reminders.load()
+    reminder = asyncio.create_task(reminders.run())
+    # Метрики отдаются на отдельном порту, не на публичном адресе вебхука
+    metrics_server = await start_metrics_server(int(METRICS_PORT)) if METRICS_PORT else None
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        if metrics_server:
+            await metrics_server.cleanup()
+        sweeper.cancel()
+        reminder.cancel()
+        await dp.storage.close()
+        await outbox.drain()
+        await ratings.drain()
+        aio.shutdown()
+        log_listener.stop()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,405 @@
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import random
+import time
+import tracemalloc
+from datetime import date, datetime
+from typing import Callable, Dict, List
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import CallbackQuery, Chat, Message, Update, User as TelegramUser
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.orm import joinedload, selectinload
+
+from bot import bot, dp
+from database.db import BOOK_COLUMNS, create_book, register_user, reserve_book, cancel_current_booking
+from database.migrations import migrate
+from database.backend import is_postgresql
+from database.models import engine, SessionLocal, Author, Book, BookAuthor, Booking, FsmState, User
+from database.schemas import BookView
+from handlers.admin import admin_router
+from handlers.user import user_router
+from utils.fake_api import FakeSession
+from utils.metrics import count_queries
+
+# Виртуальные пользователи получают заведомо несуществующие в Telegram ID, как в utils/stress.py
+BENCHMARK_USER_ID = -2_000_000
+
+_update_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> TelegramUser:
+    return TelegramUser(id=user_id, is_bot=False, first_name="benchmark")
+
+
+def _chat(user_id: int) -> Chat:
+    return Chat(id=user_id, type="private")
+
+
+def message(user_id: int, text: str) -> Update:
+    update_id = next(_update_ids)
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), chat=_chat(user_id), from_user=_user(user_id), text=text,
+    ))
+
+
+def callback(user_id: int, data: str) -> Update:
+    update_id = next(_update_ids)
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id), from_user=_user(user_id), chat_instance="benchmark", data=data,
+        message=Message(message_id=update_id, date=datetime.now(), chat=_chat(user_id), text="benchmark"),
+    ))
+
+
+class Sample:
+    """Запросы для поиска, взятые из текущей базы, и книга для бронирования и правки"""
+
+    def __init__(self, book_id: int):
+        db = SessionLocal()
+        try:
+            rows = db.execute(select(Book.title, Book.isbn, Book.language).where(Book.isbn.isnot(None)).limit(500)).all()
+            self.titles = [row.title.split()[0] for row in rows if row.title] or ["benchmark"]
+            self.isbns = [row.isbn for row in rows if row.isbn and len(row.isbn) in (10, 13) and row.isbn.isdigit()] or ["0439785960"]
+            self.languages = sorted({row.language for row in rows if row.language}) or ["benchmark"]
+            self.authors = [name.split()[-1] for name in db.scalars(select(Author.name).limit(500)) if name] or ["benchmark"]
+        finally:
+            db.close()
+        self.book_id = book_id
+
+
+def flow_registration(user_id: int, sample: Sample) -> List[Update]:
+    return [
+        message(user_id, "/start"),
+        message(user_id, "Бенчмарков Бенчмарк Бенчмаркович"),
+        message(user_id, "30"),
+        message(user_id, "79990000000"),
+    ]
+
+
+def flow_search_title(user_id: int, sample: Sample) -> List[Update]:
+    return [callback(user_id, "search_by_name"), message(user_id, random.choice(sample.titles))]
+
+
+def flow_search_author(user_id: int, sample: Sample) -> List[Update]:
+    return [callback(user_id, "search_by_author"), message(user_id, random.choice(sample.authors))]
+
+
+def flow_search_isbn(user_id: int, sample: Sample) -> List[Update]:
+    return [callback(user_id, "search_by_isbn"), message(user_id, random.choice(sample.isbns))]
+
+
+def flow_search_language(user_id: int, sample: Sample) -> List[Update]:
+    return [
+        callback(user_id, "search_book"),
+        callback(user_id, "search_by_language"),
+        callback(user_id, "languages_right"),
+        callback(user_id, f"language_{random.choice(sample.languages)}"),
+    ]
+
+
+def flow_pagination(user_id: int, sample: Sample) -> List[Update]:
+    return (
+        [callback(user_id, "search_by_name"), message(user_id, random.choice(sample.titles))]
+        + [callback(user_id, "books_right") for _ in range(5)]
+        + [callback(user_id, "books_left") for _ in range(5)]
+    )
+
+
+def flow_reservation(user_id: int, sample: Sample) -> List[Update]:
+    return [
+        callback(user_id, f"booking_{sample.book_id}"),
+        callback(user_id, "user_booking"),
+        callback(user_id, "cancel_booking"),
+    ]
+
+
+def flow_admin_edit(user_id: int, sample: Sample) -> List[Update]:
+    return [
+        callback(user_id, "find_book_id"),
+        message(user_id, str(sample.book_id)),
+        callback(user_id, "edit_info"),
+        callback(user_id, "edit_book_title"),
+        message(user_id, "benchmark"),
+    ]
+
+
+FLOWS: Dict[str, Callable[[int, Sample], List[Update]]] = {
+    "registration": flow_registration,
+    "search_title": flow_search_title,
+    "search_author": flow_search_author,
+    "search_isbn": flow_search_isbn,
+    "search_language": flow_search_language,
+    "pagination": flow_pagination,
+    "reservation": flow_reservation,
+    "admin_edit": flow_admin_edit,
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_flow(name: str, streams: List[List[Update]]) -> Dict[str, float]:
+    """Параллельная подача потоков обновлений, внутри потока - по порядку, как от одного пользователя"""
+    latencies = []
+
+    async def feed(updates: List[Update]):
+        for update in updates:
+            started = time.perf_counter()
+            await dp.feed_update(bot, update)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(updates) for updates in streams))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "flow": name,
+        "updates": len(latencies),
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "throughput": len(latencies) / elapsed,
+    }
+
+
+def read_replay(path: str) -> List[List[Update]]:
+    """Записанные обновления (JSON по строке), сгруппированные по отправителю"""
+    streams: Dict[int, List[Update]] = {}
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                update = Update.model_validate(json.loads(line), context={"bot": bot})
+                user = update.event.from_user if hasattr(update.event, "from_user") else None
+                streams.setdefault(user.id if user else 0, []).append(update)
+    return list(streams.values())
+
+
+def _prepare(users: int) -> int:
+    """Зарегистрированные виртуальные пользователи и книга с запасом экземпляров"""
+    db = SessionLocal()
+    try:
+        book = Book(title="benchmark", language="benchmark", isbn="0000000000", publication_date=date.today(),
+                    count_in_fund=users, pick_up_count=0)
+        db.add(book)
+        db.add_all(User(user_id=BENCHMARK_USER_ID - i, fullname="benchmark", age=18, phone_number=0)
+                   for i in range(users))
+        db.flush()
+        author = db.scalar(select(Author).limit(1))
+        if author is None:
+            author = Author(name="benchmark")
+            db.add(author)
+            db.flush()
+        db.add(BookAuthor(book_id=book.id, author_id=author.id))
+        db.commit()
+        return book.id
+    finally:
+        db.close()
+
+
+def _cleanup(user_ids: List[int], book_id: int):
+    db = SessionLocal()
+    try:
+        db.execute(delete(Booking).where(Booking.user_id.in_(user_ids)))
+        db.execute(delete(User).where(User.user_id.in_(user_ids)))
+        db.execute(delete(BookAuthor).where(BookAuthor.book_id == book_id))
+        db.execute(delete(Book).where(Book.id == book_id))
+        db.execute(delete(Author).where(Author.name == "benchmark", ~Author.books.any()))
+        keys = [dp.storage.key_builder.build(StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id))
+                for user_id in user_ids]
+        db.execute(delete(FsmState).where(FsmState.key.in_(keys)))
+        db.commit()
+    finally:
+        db.close()
+
+
+def write_queries():
+    """Число запросов к базе на одну операцию записи из database/db.py"""
+    user_id = BENCHMARK_USER_ID
+    operations = [
+        ("create_book", lambda: create_book(
+            title="benchmark", isbn="0000000000", isbn13="0000000000000", num_pages=1, publisher="benchmark",
+            publication_date=date.today(), age_limit=0, count_in_fund=1, author_names=["benchmark"],
+            language="benchmark",
+        )),
+        ("register_user", lambda: register_user(user_id=user_id, fullname="benchmark", age=18, phone_number=0)),
+        ("reserve_book", lambda: reserve_book(user_id=user_id, book_id=book.id)),
+        ("cancel_booking", lambda: cancel_current_booking(booking)),
+    ]
+
+    migrate()
+    book = booking = None
+    try:
+        for name, operation in operations:
+            with count_queries() as stats:
+                result = operation()
+            if name == "create_book":
+                book = result
+            elif name == "reserve_book":
+                booking = result
+            print(f"{name:<16}{stats.queries:>3} запросов")
+    finally:
+        _cleanup([user_id], book.id if book else None)
+
+
+def _authors_column():
+    names = Author.name
+    return (func.string_agg(names, ", ") if is_postgresql(engine) else func.group_concat(names, ", ")).label("authors")
+
+
+# Способы загрузки книг вместе с авторами: запрос -> список строк результата
+LOADERS = {
+    "joinedload": lambda db, where: db.scalars(
+        select(Book).options(joinedload(Book.authors)).where(*where)).unique().all(),
+    "selectinload": lambda db, where: db.scalars(
+        select(Book).options(selectinload(Book.authors)).where(*where)).all(),
+    "string_agg": lambda db, where: db.execute(
+        select(Book, _authors_column()).outerjoin(BookAuthor, BookAuthor.book_id == Book.id)
+        .outerjoin(Author, Author.id == BookAuthor.author_id).where(*where).group_by(Book.id)).all(),
+    # Как в database/db.py: авторы коррелированным подзапросом в колонках карточки
+    "authors_column": lambda db, where: db.execute(select(*BOOK_COLUMNS).where(*where)).all(),
+}
+
+
+def loader_queries(repeat: int = 3):
+    """Сравнение способов загрузки авторов: запросы, строки из базы и время гидрации на каталоге"""
+    migrate()
+    workloads = {
+        "весь каталог": [],
+        "один язык": [Book.language == "Английский"],
+    }
+    print(f"{'Выборка':<14}{'загрузка':<14}{'книг':>7}{'запросов':>10}{'строк':>8}{'всего, мс':>11}{'SQL, мс':>9}{'Python, мс':>12}")
+
+    for workload, where in workloads.items():
+        for name, load in LOADERS.items():
+            statements = []
+
+            def capture(conn, cursor, statement, parameters, context, executemany):
+                statements.append((statement, parameters))
+
+            timings = []
+            for _ in range(repeat):
+                statements.clear()
+                db = SessionLocal()
+                event.listen(engine, "before_cursor_execute", capture)
+                try:
+                    with count_queries() as stats:
+                        started = time.perf_counter()
+                        books = load(db, where)
+                        timings.append((time.perf_counter() - started, stats.db_time, stats.queries))
+                finally:
+                    event.remove(engine, "before_cursor_execute", capture)
+                    db.close()
+
+            with engine.connect() as connection:
+                rows = sum(connection.exec_driver_sql(f"SELECT count(*) FROM ({statement}) AS counted", parameters).scalar()
+                           for statement, parameters in statements)
+
+            total, db_time, queries = min(timings)
+            print(f"{workload:<14}{name:<14}{len(books):>7}{queries:>10}{rows:>8}"
+                  f"{total * 1000:>11.0f}{db_time * 1000:>9.0f}{(total - db_time) * 1000:>12.0f}")
+
+
+# Карточки книг каталога: ORM-объекты с авторами против BookView из строк
+VIEW_BUILDERS = {
+    "ORM Book": lambda db: db.scalars(select(Book).options(selectinload(Book.authors))).all(),
+    "BookView": lambda db: [BookView._make(row) for row in db.execute(select(*BOOK_COLUMNS))],
+}
+
+
+def view_objects(repeat: int = 3):
+    """Время построения карточек всего каталога и память, которую занимает одна карточка"""
+    migrate()
+    print(f"{'Карточки':<12}{'книг':>7}{'всего, мс':>11}{'SQL, мс':>9}{'Python, мс':>12}{'байт на книгу':>15}")
+
+    for name, build in VIEW_BUILDERS.items():
+        timings = []
+        for _ in range(repeat):
+            db = SessionLocal()
+            try:
+                with count_queries() as stats:
+                    started = time.perf_counter()
+                    build(db)
+                    timings.append((time.perf_counter() - started, stats.db_time))
+            finally:
+                db.close()
+
+        # Учитывается только то, что остается в памяти после закрытия сессии вместе со списком карточек
+        gc.collect()
+        tracemalloc.start()
+        try:
+            db = SessionLocal()
+            try:
+                books = build(db)
+            finally:
+                db.close()
+            gc.collect()
+            memory, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        total, db_time = min(timings)
+        print(f"{name:<12}{len(books):>7}{total * 1000:>11.0f}{db_time * 1000:>9.0f}"
+              f"{(total - db_time) * 1000:>12.0f}{memory / max(len(books), 1):>15.0f}")
+        del books
+
+
+async def benchmark(flows: List[str], users: int, iterations: int, latency: float, replay: str = None):
+    migrate()
+    bot.session = FakeSession(latency=latency)
+    dp.include_routers(admin_router, user_router)
+
+    book_id = _prepare(users)
+    sample = Sample(book_id)
+    registered = [BENCHMARK_USER_ID - i for i in range(users)]
+    # Регистрация проходит от имени еще не зарегистрированных пользователей
+    newcomers = iter(range(BENCHMARK_USER_ID - users, BENCHMARK_USER_ID - users - users * iterations - 1, -1))
+    results = []
+
+    try:
+        for name in flows:
+            if name == "registration":
+                streams = [FLOWS[name](next(newcomers), sample) for _ in range(users * iterations)]
+                streams = [list(itertools.chain(*streams[i::users])) for i in range(users)]
+            else:
+                streams = [list(itertools.chain(*(FLOWS[name](user_id, sample) for _ in range(iterations))))
+                           for user_id in registered]
+            results.append(await run_flow(name, streams))
+        if replay:
+            results.append(await run_flow("replay", read_replay(replay)))
+    finally:
+        # Отложенные записи FSM не должны вернуть строки после очистки
+        await dp.storage.flush()
+        _cleanup(list(range(BENCHMARK_USER_ID - users - users * iterations, BENCHMARK_USER_ID + 1)), book_id)
+
+    print(f"{'Сценарий':<16}{'обновлений':>11}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'обн./с':>10}")
+    for result in results:
+        print(f"{result['flow']:<16}{result['updates']:>11}{result['p50']:>10.1f}{result['p95']:>10.1f}"
+              f"{result['p99']:>10.1f}{result['throughput']:>10.0f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон обработчиков через dp.feed_update")
+    parser.add_argument("--flows", nargs="+", choices=list(FLOWS), default=list(FLOWS))
+    parser.add_argument("--users", type=int, default=20, help="одновременных виртуальных пользователей")
+    parser.add_argument("--iterations", type=int, default=5, help="повторов сценария на пользователя")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа фиктивного Bot API, с")
+    parser.add_argument("--replay", help="файл с записанными обновлениями, JSON по строке")
+    parser.add_argument("--writes", action="store_true", help="только число запросов на операцию записи")
+    parser.add_argument("--loaders", action="store_true", help="только сравнение способов загрузки авторов")
+    parser.add_argument("--views", action="store_true", help="только память и время построения карточек книг")
+    args = parser.parse_args()
+
+    if args.writes:
+        write_queries()
+    elif args.loaders:
+        loader_queries()
+    elif args.views:
+        view_objects()
+    else:
+        asyncio.run(benchmark(args.flows, args.users, args.iterations, args.latency, args.replay))
@@ -0,0 +1,64 @@
+import itertools
+import os
+from datetime import datetime
+from typing import Dict
+
+from database.schemas import BookView
+from utils.cache import TTLCache
+
+CAPTION_CACHE_SIZE = int(os.getenv("CAPTION_CACHE_SIZE", 10000))
+# Предел устаревания подписи, если книгу изменили в обход edit_record и add_ratings
+CAPTION_CACHE_TTL = float(os.getenv("CAPTION_CACHE_TTL", 3600))
+
+BOOK_CAPTION = (
+    "<b>📖 Название:</b> {title}\n"
+    "<b>👥 Авторы:</b> {authors}\n"
+    "<b>🌐 Язык издания:</b> {language}\n"
+    "<b>📌 ISBN(10/13):</b> <code>{isbn}</code> / <code>{isbn13}</code>\n"
+    "<b>📝 Количество страниц:</b> {num_pages}\n"
+    "<b>⭐ Рейтинг:</b> {average_rating}\n"
+    "<b>📅 Дата публикации:</b> {publication_date}\n"
+    "<b>🖨️ Издательство:</b> {publisher}\n"
+)
+
+ADMIN_BOOK_CAPTION = (
+    "<b>🔐 ID:</b> <code>{id}</code>\n\n"
+    "<b>📖 Название:</b> <code>{title}</code>\n"
+    "<b>👥 Авторы:</b> <code>{authors}</code>\n"
+    "<b>🌐 Язык издания:</b> <code>{language}</code>\n"
+    "<b>📌 ISBN(10/13):</b> <code>{isbn}</code> / <code>{isbn13}</code>\n"
+    "<b>📝 Количество страниц:</b> <code>{num_pages}</code>\n"
+    "<b>⭐ Рейтинг:</b> <code>{average_rating}</code>\n"
+    "<b>📅 Дата публикации:</b> <code>{publication_date}</code>\n"
+    "<b>🖨️ Издательство:</b> <code>{publisher}</code>\n"
+    "<b>🧮 Количество в наличии:</b> <code>{count_in_fund}</code>\n"
+)
+
+# Подписи карточек по (book_id, версия книги); изменение книги поднимает версию,
+# и старая подпись больше не находится, а затем вытесняется из LRU
+_captions = TTLCache(maxsize=CAPTION_CACHE_SIZE, ttl=CAPTION_CACHE_TTL)
+_versions: Dict[int, int] = {}
+_version_counter = itertools.count(1)
+
+
+def invalidate(book_id: int):
+    _versions[book_id] = next(_version_counter)
+
+
+def book_caption(book: BookView) -> str:
+    """Подпись карточки книги для читателя, отрисовывается один раз на версию книги"""
+    key = (book.id, _versions.get(book.id, 0))
+    caption = _captions.get(key)
+    if caption is None:
+        caption = BOOK_CAPTION.format_map(book._asdict())
+        _captions.set(key, caption)
+    return caption
+
+
+def admin_book_caption(book: BookView) -> str:
+    # Не кэшируется: количество в наличии меняется с каждой бронью
+    return ADMIN_BOOK_CAPTION.format_map(book._asdict())
+
+
+def format_datetime(value: datetime) -> str:
+    return value.strftime("%d.%m.%Y %H:%M")
@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+# Сообщений в секунду на бота и на один чат. Telegram допускает 30 и 1; пачка сверх
+# частоты расходует запас корзины, поэтому DELIVERY_RATE + DELIVERY_BATCH_SIZE не больше 30
+DELIVERY_RATE = float(os.getenv("DELIVERY_RATE", 25))
+DELIVERY_CHAT_RATE = float(os.getenv("DELIVERY_CHAT_RATE", 1))
+# Сколько сообщений разным чатам отправляется одновременно
+DELIVERY_BATCH_SIZE = int(os.getenv("DELIVERY_BATCH_SIZE", 5))
+# Сколько раз повторять отправку после 429 Too Many Requests
+DELIVERY_RETRIES = int(os.getenv("DELIVERY_RETRIES", 3))
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float):
+        """Опустошение корзины так, чтобы следующий токен появился через seconds"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class OutboundQueue:
+    """Очередь исходящих уведомлений с ограничением частоты отправки.
+
+    Сообщения одного чата уходят по порядку не чаще chat_rate в секунду, все
+    вместе - не чаще rate. Готовые к отправке чаты хранятся в куче по времени,
+    когда им снова можно писать; за один проход отправляется пачка сообщений
+    разным чатам. На 429 отправка приостанавливается на retry_after секунд"""
+
+    def __init__(self, rate: float = DELIVERY_RATE, chat_rate: float = DELIVERY_CHAT_RATE,
+                 batch_size: int = DELIVERY_BATCH_SIZE, retries: int = DELIVERY_RETRIES):
+        self.chat_interval = 1 / chat_rate
+        self.batch_size = batch_size
+        self.retries = retries
+        self.bucket = TokenBucket(rate, capacity=batch_size)
+        self.bot: Optional[Bot] = None
+        # Очереди сообщений по чатам и куча (когда можно писать, порядковый номер, чат)
+        self._pending: Dict[Any, Deque[Tuple[str, Dict[str, Any], int]]] = {}
+        self._ready: List[Tuple[float, int, Any]] = []
+        self._next_send: Dict[Any, float] = {}
+        self._order = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.failed = 0
+
+    def start(self, bot: Bot):
+        self.bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    def __len__(self):
+        return sum(len(messages) for messages in self._pending.values())
+
+    def _push_chat(self, chat_id, at: float):
+        heapq.heappush(self._ready, (at, next(self._order), chat_id))
+        self._wakeup.set()
+
+    async def send_message(self, chat_id, text: str, **kwargs):
+        """Постановка сообщения в очередь; возвращается сразу, не дожидаясь отправки"""
+        self._idle.clear()
+        messages = self._pending.get(chat_id)
+        if messages is None:
+            messages = self._pending[chat_id] = deque()
+            self._push_chat(chat_id, self._next_send.get(chat_id, 0.0))
+        messages.append((text, kwargs, 0))
+
+    async def _deliver(self, chat_id, text: str, kwargs: Dict[str, Any], attempt: int) -> Optional[float]:
+        """Отправка одного сообщения; возвращает retry_after, если Telegram попросил подождать"""
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            self.sent += 1
+        except TelegramRetryAfter as e:
+            if attempt < self.retries:
+                return float(e.retry_after)
+            self.failed += 1
+            logging.warning("Сообщение пользователю %s не отправлено после %s попыток", chat_id, attempt + 1)
+        except TelegramAPIError as e:
+            # Пользователь заблокировал бота, чат не найден и т.п. - повторять бессмысленно
+            self.failed += 1
+            logging.warning("Не удалось отправить сообщение пользователю %s: %s", chat_id, e)
+        return None
+
+    def _take_batch(self, now: float) -> List[Tuple[Any, str, Dict[str, Any], int]]:
+        batch = []
+        while self._ready and self._ready[0][0] <= now and len(batch) < self.batch_size:
+            if self.bucket.delay(now) > 0:
+                break
+            _, _, chat_id = heapq.heappop(self._ready)
+            text, kwargs, attempt = self._pending[chat_id].popleft()
+            self.bucket.consume(now)
+            self._next_send[chat_id] = now + self.chat_interval
+            batch.append((chat_id, text, kwargs, attempt))
+        return batch
+
+    def _requeue(self, now: float, chat_id, text: str, kwargs: Dict[str, Any], attempt: int, delay: float = 0.0):
+        messages = self._pending[chat_id]
+        if delay:
+            messages.appendleft((text, kwargs, attempt))
+            self._next_send[chat_id] = max(self._next_send[chat_id], now + delay)
+        if messages:
+            self._push_chat(chat_id, self._next_send[chat_id])
+        else:
+            del self._pending[chat_id]
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+
+            if not self._ready:
+                self._next_send = {chat_id: at for chat_id, at in self._next_send.items() if at > now}
+                self._idle.set()
+                await self._wakeup.wait()
+                continue
+
+            delay = max(self._ready[0][0] - now, self.bucket.delay(now))
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            batch = self._take_batch(now)
+            results = await asyncio.gather(*(self._deliver(*item) for item in batch))
+
+            now = time.monotonic()
+            for (chat_id, text, kwargs, attempt), retry_after in zip(batch, results):
+                if retry_after:
+                    # 429 говорит о превышении лимита бота в целом, поэтому притормаживаются все чаты
+                    self.bucket.pause(now, retry_after)
+                    self._requeue(now, chat_id, text, kwargs, attempt + 1, delay=retry_after)
+                else:
+                    self._requeue(now, chat_id, text, kwargs, attempt)
+
+    async def drain(self):
+        """Ожидание отправки всех сообщений из очереди и остановка"""
+        if self._task is None:
+            return
+        await self._idle.wait()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+
+outbox = OutboundQueue()
+
+
+async def _check(messages: int = 60, chats: int = 3):
+    """Отправка через фиктивный Bot API, который отвечает 429 при нарушении лимитов"""
+    from utils.fake_api import fake_bot
+
+    bot = fake_bot(flood_limits=True)
+    queue = OutboundQueue()
+    queue.start(bot)
+    started = time.monotonic()
+    for i in range(messages):
+        await queue.send_message(i % chats if i < messages // 2 else 1000 + i, f"Сообщение {i}")
+    await queue.drain()
+
+    elapsed = time.monotonic() - started
+    print(f"Отправлено {queue.sent}, не отправлено {queue.failed}, отказов 429: {bot.session.rejected}, "
+          f"время {elapsed:.1f} с")
+
+
+if __name__ == "__main__":
+    asyncio.run(_check())
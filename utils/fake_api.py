@@ -0,0 +1,73 @@
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, Message
+
+
+class FakeSession(BaseSession):
+    """Сессия Bot API без сети: запоминает вызовы и отвечает как Telegram.
+
+    С flood_limits=True соблюдает ограничения Telegram (30 сообщений в секунду
+    на бота и 1 в секунду на чат) и при их нарушении бросает TelegramRetryAfter"""
+
+    def __init__(self, flood_limits: bool = False, latency: float = 0.0):
+        super().__init__()
+        self.flood_limits = flood_limits
+        self.latency = latency
+        self.requests: List[Tuple[float, TelegramMethod]] = []
+        self.rejected = 0
+        self._message_id = 0
+        self._chat_sent: Dict[Any, float] = defaultdict(float)
+
+    def _check_limits(self, method: TelegramMethod, now: float):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return
+        recent = sum(1 for sent_at, _ in self.requests[-30:] if now - sent_at < 1)
+        retry_after = 0
+        if recent >= 30:
+            retry_after = 1
+        elif now - self._chat_sent[chat_id] < 1:
+            retry_after = 1
+        if retry_after:
+            self.rejected += 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=retry_after)
+        self._chat_sent[chat_id] = now
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        now = time.monotonic()
+        if self.flood_limits:
+            self._check_limits(method, now)
+        self.requests.append((now, method))
+
+        if method.__returning__ is Message:
+            self._message_id += 1
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=getattr(method, "chat_id", 0), type="private"),
+                text=getattr(method, "text", None),
+            )
+        return True
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+def fake_bot(**kwargs) -> Bot:
+    """Бот с фиктивным токеном поверх FakeSession"""
+    return Bot(token="42:TEST", session=FakeSession(**kwargs))
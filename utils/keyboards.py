@@ -1,4 +1,6 @@
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from functools import lru_cache
+from typing import Tuple
 
 keyboard_menu = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="Поиск книги", callback_data="search_book")],
@@ -18,6 +20,16 @@ buttons_lang_arrows = [
     InlineKeyboardButton(text="➡️", callback_data=f"languages_right")
 ]
 
+@lru_cache(maxsize=64)
+def keyboard_languages(languages: Tuple[str, ...], index: int, page_size: int = 5) -> InlineKeyboardMarkup:
+    """Страница клавиатуры выбора языка, кэшируется по каталогу языков и смещению"""
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+    for language in languages[index:index + page_size]:
+        keyboard.inline_keyboard.insert(0, [InlineKeyboardButton(text=language, callback_data=f"language_{language}")])
+    keyboard.inline_keyboard.append(buttons_lang_arrows)
+    keyboard.inline_keyboard.append([InlineKeyboardButton(text="Отмена поиска", callback_data="cancel_search")])
+    return keyboard
+
 keyboard_cancel_search = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True, keyboard=[
     [KeyboardButton(text="Отмена поиска")]
 ])
@@ -76,6 +88,7 @@ keyboard_edit = InlineKeyboardMarkup(inline_keyboard=[
 
 keyboard_edit_book = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="Изменить название", callback_data="edit_book_title")],
+    [InlineKeyboardButton(text="Изменить язык издания", callback_data="edit_book_language")],
     [InlineKeyboardButton(text="↩️ Вернуться в панель", callback_data="admin_panel")],
 ])
 
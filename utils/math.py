@@ -1,98 +1,139 @@
 from database.models import SessionLocal, Book, Author, BookAuthor, User, Booking, BookingStatus
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, func, bindparam
+from bisect import bisect_right
+import heapq
+from utils import captions
 import logging
 from math import log
-from datetime import datetime
+from datetime import date, datetime
+
+def add_ratings(deltas: Dict[int, Tuple[int, int]]):
+    """Атомарное добавление оценок: {book_id: (количество оценок, их сумма)}.
+
+    Новое среднее считается в UPDATE, поэтому параллельные оценки не теряются"""
+    if not deltas:
+        return
 
-def add_rating(book_id: int, rating: int):
     db = SessionLocal()
 
     try:
-        book = db.query(Book).filter(Book.id == book_id).first()
-        if not 1 <= rating <= 5:
-            raise ValueError("Рейтинг должен быть от 1 до 5")
-        
-        alpha = book.ratings_count / (book.ratings_count + 1)
-        
-        book.average_rating = alpha * book.average_rating + (1 - alpha) * rating
-        book.ratings_count += 1
-
+        books = Book.__table__
+        ratings_count = func.coalesce(books.c.ratings_count, 0)
+        db.execute(
+            books.update()
+            .where(books.c.id == bindparam("rated_book_id"))
+            .values(
+                average_rating=(func.coalesce(books.c.average_rating, 0) * ratings_count + bindparam("total"))
+                               / (ratings_count + bindparam("count")),
+                ratings_count=ratings_count + bindparam("count"),
+            ),
+            [{"rated_book_id": book_id, "count": count, "total": total} for book_id, (count, total) in deltas.items()],
+        )
         db.commit()
-        db.refresh(book)
+        for book_id in deltas:
+            captions.invalidate(book_id)
     except Exception as e:
         db.rollback()
-        logging.error(f"Ошибка при обновлении рейтинга книги: {str(e)}")
+        logging.error("Ошибка при обновлении рейтинга книги: %s", e)
         raise ValueError(f"Ошибка при обновлении рейтинга книги: {str(e)}")
-    
+
     finally:
         db.close()
 
-def get_demand_index():
+def add_rating(book_id: int, rating: int):
+    if not 1 <= rating <= 5:
+        raise ValueError("Рейтинг должен быть от 1 до 5")
+    add_ratings({book_id: (1, rating)})
+
+def book_demand(pick_up_count: int, count_in_fund: int, last_booking_date: Optional[datetime], now: datetime) -> float:
+    """Индекс востребованности одной книги"""
+    days_since_last = (now - (last_booking_date or now)).days
+    days_since_last = max(days_since_last, 0.1)
+    count_in_fund = count_in_fund if count_in_fund > 0 else 1
+
+    return (pick_up_count / count_in_fund) * log(1 + 1 / days_since_last)
+
+def rank_demands(demand_values: list, limit: Optional[int] = None) -> list:
+    """Сортировка пар (название, индекс) и процентили через бинарный поиск по отсортированным индексам"""
+    if not demand_values:
+        return []
+
+    demands_sorted = sorted(demand for _, demand in demand_values)
+    total = len(demands_sorted)
+
+    if limit is None:
+        top_books = sorted(demand_values, key=lambda x: x[1], reverse=True)
+    else:
+        top_books = heapq.nlargest(limit, demand_values, key=lambda x: x[1])
+
+    demands = []
+    for title, demand in top_books:
+        percentile = bisect_right(demands_sorted, demand) / total * 100
+        demands.append({
+            "title": title,
+            "demand": round(demand, 2),
+            "percentile": round(percentile, 2)
+        })
+
+    return demands
+
+def get_demand_index(limit: Optional[int] = None):
     """Индекс = (Количество взятий) / (Количество копий) * log(1 + 1 / Дней с последнего взятия)"""
 
     db = SessionLocal()
     try:
-        demands = []
-        books = db.query(Book).all()
-        
-        if not books:
-            return []
-
-        demand_values = []
-        for book in books:
-            last_booking_date = (
-                max([b.booking_date for b in book.bookings]) 
-                if book.bookings 
-                else datetime.now()
-            )
-            days_since_last = (datetime.now() - last_booking_date).days
-            days_since_last = max(days_since_last, 0.1)
-            count_in_fund = book.count_in_fund if book.count_in_fund > 0 else 1
-            
-            demand = (book.pick_up_count / count_in_fund) * log(1 + 1 / days_since_last)
-            demand_values.append((book, demand))
-
-        sorted_books = sorted(demand_values, key=lambda x: x[1], reverse=True)
-        
-        demands_sorted = [item[1] for item in sorted_books]
-        for book, demand in sorted_books:
-            percentile = sum(1 for d in demands_sorted if d <= demand) / len(demands_sorted) * 100
-            demands.append({
-                "title": book.title,
-                "demand": round(demand, 2),
-                "percentile": round(percentile, 2)
-            })
-            
-        return demands
+        rows = db.execute(
+            select(Book.title, Book.pick_up_count, Book.count_in_fund, func.max(Booking.booking_date))
+            .outerjoin(Booking, Booking.book_id == Book.id)
+            .group_by(Book.id)
+        ).all()
+
+        now = datetime.now()
+        demand_values = [
+            (title, book_demand(pick_up_count, count_in_fund, last_booking_date, now))
+            for title, pick_up_count, count_in_fund, last_booking_date in rows
+        ]
+
+        return rank_demands(demand_values, limit)
     except Exception as e:
-        logging.error(f"Ошибка: {str(e)}")
+        logging.error("Ошибка: %s", e)
         raise ValueError(f"Ошибка: {str(e)}")
     finally:
         db.close()
 
+def balance_ratio(pick_up_count: int, count_in_fund: int, publication_date: date, now: datetime) -> float:
+    """Отношение взятий к копиям на год нахождения книги в фонде"""
+    years_in_fund = (now - datetime(publication_date.year, publication_date.month, publication_date.day)).days / 365.25
+
+    years_in_fund = max(years_in_fund, 0.1)
+    count_in_fund = count_in_fund if count_in_fund > 0 else 1
+
+    return (pick_up_count / count_in_fund) / years_in_fund
+
 def calculate_balance_coefficient():
     """Коэффициент = Среднее значение по всем книгам (Количество взятий / Количество копий) / Срок нахождения книги в фонде"""
     db = SessionLocal()
     try:
-        books = db.query(Book).all()
-        total_books = len(books)
+        rows = db.execute(
+            select(Book.pick_up_count, Book.count_in_fund, Book.publication_date)
+            .execution_options(yield_per=2000)
+        )
+
+        now = datetime.now()
+        total_books = 0
+        sum_ratio = 0.0
+        for pick_up_count, count_in_fund, publication_date in rows:
+            sum_ratio += balance_ratio(pick_up_count, count_in_fund, publication_date, now)
+            total_books += 1
+
         if total_books == 0:
             return 0.0
-        
-        sum_ratio = 0.0
-        for book in books:
-            years_in_fund = (datetime.now() - datetime(book.publication_date.year, book.publication_date.month, book.publication_date.day)).days / 365.25
-            
-            years_in_fund = max(years_in_fund, 0.1)
-            count_in_fund = book.count_in_fund if book.count_in_fund > 0 else 1
-            
-            ratio = (book.pick_up_count / count_in_fund) / years_in_fund
-            sum_ratio += ratio
-        
+
         K_b = sum_ratio / total_books
         return K_b
     except Exception as e:
-        logging.error(f"Ошибка: {str(e)}")
+        logging.error("Ошибка: %s", e)
         raise ValueError(f"Ошибка: {str(e)}")
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
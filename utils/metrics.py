@@ -0,0 +1,231 @@
+import bisect
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+from aiohttp import web
+from sqlalchemy import event
+
+from database.models import engine
+
+# Порт отдельного сервера /metrics в режиме polling; в режиме webhook путь добавляется в приложение вебхука
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+# Сколько одинаковых запросов за одно обновление считается признаком N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин, как в Prometheus"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль q"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class HandlerStats:
+    __slots__ = ("latency", "queries", "db_time", "n_plus_one", "errors")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.queries = 0
+        self.db_time = 0.0
+        self.n_plus_one = 0
+        self.errors = 0
+
+
+class UpdateStats:
+    """Запросы к базе в рамках одного обновления; заполняется и из потоков database.aio"""
+    __slots__ = ("handler", "queries", "db_time", "statements", "started")
+
+    def __init__(self):
+        self.handler = "unhandled"
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.started: Dict[int, float] = {}
+
+
+current_update: contextvars.ContextVar[Optional[UpdateStats]] = contextvars.ContextVar("current_update", default=None)
+
+
+class Metrics:
+    def __init__(self):
+        self.handlers: Dict[str, HandlerStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stats: UpdateStats, elapsed: float, failed: bool):
+        repeated = [(statement, count) for statement, count in stats.statements.items() if count >= N_PLUS_ONE_THRESHOLD]
+        with self._lock:
+            handler = self.handlers.get(stats.handler)
+            if handler is None:
+                handler = self.handlers[stats.handler] = HandlerStats()
+            handler.latency.observe(elapsed)
+            handler.queries += stats.queries
+            handler.db_time += stats.db_time
+            handler.errors += failed
+            handler.n_plus_one += bool(repeated)
+
+        for statement, count in repeated:
+            logging.warning(
+                "Возможный N+1 в %s: запрос выполнен %s раз за обновление: %.200s", stats.handler, count, statement
+            )
+
+    def summary(self) -> str:
+        """Сводка для админа, самые затратные по суммарному времени обработчики сверху"""
+        with self._lock:
+            items = sorted(self.handlers.items(), key=lambda item: item[1].latency.sum, reverse=True)
+            lines = []
+            for name, stats in items:
+                count = stats.latency.count
+                lines.append(
+                    f"<b>{name}</b>: {count} обн., среднее {stats.latency.sum / count * 1000:.0f} мс, "
+                    f"p95 ≤ {stats.latency.quantile(0.95) * 1000:.0f} мс, "
+                    f"запросов {stats.queries / count:.1f}/обн., БД {stats.db_time / count * 1000:.0f} мс/обн."
+                    + (f", N+1: {stats.n_plus_one}" if stats.n_plus_one else "")
+                    + (f", ошибок: {stats.errors}" if stats.errors else "")
+                )
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        lines = [
+            "# HELP bot_handler_latency_seconds Время обработки обновления",
+            "# TYPE bot_handler_latency_seconds histogram",
+        ]
+        with self._lock:
+            items = sorted(self.handlers.items())
+            for name, stats in items:
+                cumulative = 0
+                for bound, count in zip(stats.latency.buckets + ("+Inf",), stats.latency.counts):
+                    cumulative += count
+                    lines.append(f'bot_handler_latency_seconds_bucket{{handler="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'bot_handler_latency_seconds_sum{{handler="{name}"}} {stats.latency.sum}')
+                lines.append(f'bot_handler_latency_seconds_count{{handler="{name}"}} {stats.latency.count}')
+
+            for metric, help_text, attr in (
+                ("bot_handler_db_queries_total", "Запросы к базе", "queries"),
+                ("bot_handler_db_seconds_total", "Время запросов к базе", "db_time"),
+                ("bot_handler_n_plus_one_total", "Обновления с повторяющимися запросами", "n_plus_one"),
+                ("bot_handler_errors_total", "Обновления, завершившиеся исключением", "errors"),
+            ):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for name, stats in items:
+                    lines.append(f'{metric}{{handler="{name}"}} {getattr(stats, attr)}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_update.get()
+    if stats is not None:
+        stats.started[id(cursor)] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_update.get()
+    if stats is not None:
+        started = stats.started.pop(id(cursor), None)
+        stats.queries += 1
+        stats.statements[statement] += 1
+        if started is not None:
+            stats.db_time += time.perf_counter() - started
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Внешний middleware обновлений: время обработки и запросы к базе"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        stats = UpdateStats()
+        token = current_update.set(stats)
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            current_update.reset(token)
+            metrics.record(stats, time.perf_counter() - started, failed)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Внутренний middleware: запоминает имя выбранного обработчика для MetricsMiddleware"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        stats = current_update.get()
+        if stats is not None and "handler" in data:
+            stats.handler = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+def instrument_engine():
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+@contextlib.contextmanager
+def count_queries():
+    """Подсчет запросов к базе внутри блока, например для замеров в utils/benchmark.py"""
+    instrument_engine()
+    stats = UpdateStats()
+    token = current_update.set(stats)
+    try:
+        yield stats
+    finally:
+        current_update.reset(token)
+
+
+def setup_metrics(dp: Dispatcher):
+    dp.update.outer_middleware(MetricsMiddleware())
+    dp.message.middleware(HandlerNameMiddleware())
+    dp.callback_query.middleware(HandlerNameMiddleware())
+    instrument_engine()
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.prometheus(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(port: int, path: str = METRICS_PATH) -> web.AppRunner:
+    """Отдельный сервер метрик, его порт не должен быть доступен извне"""
+    app = web.Application()
+    app.router.add_get(path, metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    logging.info("Метрики доступны на порту %s%s", port, path)
+    return runner
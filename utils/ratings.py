@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional
+
+from database.aio import run_sync
+from utils.cache import TTLCache
+from utils.math import add_ratings
+
+# Накапливать оценки в памяти и записывать суммарные приращения по книгам раз в RATING_FLUSH_MS
+RATING_BUFFERED = os.getenv("RATING_BUFFERED", "0") == "1"
+RATING_FLUSH_MS = float(os.getenv("RATING_FLUSH_MS", 500))
+# Сколько секунд повторная оценка той же книги тем же пользователем не принимается
+RATING_DEDUP_TTL = float(os.getenv("RATING_DEDUP_TTL", 24 * 60 * 60))
+RATING_DEDUP_SIZE = int(os.getenv("RATING_DEDUP_SIZE", 100000))
+
+
+class RatingBuffer:
+    """Прием оценок книг с отсечением повторных голосов.
+
+    В буферизованном режиме оценки суммируются по книгам и записываются одним
+    пакетным UPDATE в фоне, иначе каждая оценка сразу записывается атомарным UPDATE"""
+
+    def __init__(self, buffered: bool = RATING_BUFFERED, flush_ms: float = RATING_FLUSH_MS,
+                 dedup_ttl: float = RATING_DEDUP_TTL, dedup_size: int = RATING_DEDUP_SIZE):
+        self.buffered = buffered
+        self.interval = flush_ms / 1000
+        self._voted = TTLCache(maxsize=dedup_size, ttl=dedup_ttl)
+        # book_id -> [количество оценок, сумма оценок]
+        self._pending: Dict[int, List[int]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.buffered:
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, user_id: int, book_id: int, rating: int) -> bool:
+        """Прием оценки; False, если пользователь уже недавно оценил эту книгу"""
+        if not 1 <= rating <= 5:
+            raise ValueError("Рейтинг должен быть от 1 до 5")
+        if self._voted.get((user_id, book_id)):
+            return False
+        self._voted.set((user_id, book_id), True)
+
+        if not self.buffered:
+            try:
+                await run_sync(add_ratings, {book_id: (1, rating)})
+            except ValueError:
+                self._voted.invalidate((user_id, book_id))
+                raise
+            return True
+
+        delta = self._pending.setdefault(book_id, [0, 0])
+        delta[0] += 1
+        delta[1] += rating
+        return True
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await run_sync(add_ratings, {book_id: tuple(delta) for book_id, delta in pending.items()})
+            logging.debug("Записаны оценки %s книг", len(pending))
+        except ValueError:
+            # Оценки возвращаются в буфер и будут записаны при следующей попытке
+            for book_id, (count, total) in pending.items():
+                delta = self._pending.setdefault(book_id, [0, 0])
+                delta[0] += count
+                delta[1] += total
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def drain(self):
+        """Остановка фоновой записи и запись оставшихся оценок"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+ratings = RatingBuffer()
@@ -0,0 +1,112 @@
+import asyncio
+import heapq
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Tuple
+
+from database.aio import get_return_deadlines
+from utils.delivery import outbox
+
+# Время суток, в которое отправляются напоминания
+REMINDER_HOUR = int(os.getenv("REMINDER_HOUR", 10))
+# Напоминания, которые опоздали больше чем на это число часов (например, бот был выключен), не отправляются
+REMINDER_GRACE_HOURS = float(os.getenv("REMINDER_GRACE_HOURS", 24))
+
+DUE = "due"
+OVERDUE = "overdue"
+
+
+def reminder_times(return_deadline: date) -> List[Tuple[datetime, str]]:
+    """Моменты напоминаний: накануне срока возврата и на следующий день после него"""
+    at = time(hour=REMINDER_HOUR)
+    return [
+        (datetime.combine(return_deadline - timedelta(days=1), at), DUE),
+        (datetime.combine(return_deadline + timedelta(days=1), at), OVERDUE),
+    ]
+
+
+class ReminderScheduler:
+    """Напоминания о сроке возврата взятых книг на куче ближайших срабатываний.
+
+    Таблица bookings читается целиком один раз при запуске, дальше изменения
+    бронирований передаются через track. Устаревшие элементы кучи не удаляются,
+    а пропускаются при срабатывании по сверке со сроком в _deadlines"""
+
+    def __init__(self, grace_hours: float = REMINDER_GRACE_HOURS):
+        self.grace = timedelta(hours=grace_hours)
+        self._heap: List[Tuple[datetime, int, str, date]] = []
+        # id бронирования -> (user_id, название книги, срок возврата)
+        self._deadlines: Dict[int, Tuple[int, str, date]] = {}
+        self._wakeup = asyncio.Event()
+
+    def _schedule(self, booking_id: int, user_id: int, title: str, return_deadline: date):
+        self._deadlines[booking_id] = (user_id, title, return_deadline)
+        now = datetime.now()
+        for fire_at, kind in reminder_times(return_deadline):
+            if fire_at > now - self.grace:
+                heapq.heappush(self._heap, (fire_at, booking_id, kind, return_deadline))
+        self._wakeup.set()
+
+    async def load(self):
+        """Загрузка сроков возврата всех взятых книг"""
+        self._heap.clear()
+        self._deadlines.clear()
+        for row in await get_return_deadlines():
+            self._schedule(*row)
+        logging.info("Запланированы напоминания для %s бронирований", len(self._deadlines))
+
+    async def track(self, booking_id: int):
+        """Перечитывание одного бронирования после его изменения"""
+        rows = await get_return_deadlines(booking_id=booking_id)
+        if rows:
+            if self._deadlines.get(booking_id) != rows[0][1:]:
+                self._schedule(*rows[0])
+        else:
+            self._deadlines.pop(booking_id, None)
+
+    async def _remind(self, booking_id: int, kind: str, scheduled_deadline: date):
+        # Перед отправкой статус сверяется по первичному ключу: книгу могли вернуть
+        # в обход админ-панели, и track об этом не узнал
+        rows = await get_return_deadlines(booking_id=booking_id)
+        if not rows:
+            self._deadlines.pop(booking_id, None)
+            return
+
+        _, user_id, title, return_deadline = rows[0]
+        if return_deadline != scheduled_deadline:
+            return
+        if kind == DUE:
+            text = f'Завтра, {return_deadline.strftime("%d.%m.%Y")}, истекает срок возврата книги "{title}"'
+        else:
+            text = f'Срок возврата книги "{title}" истек {return_deadline.strftime("%d.%m.%Y")}, пожалуйста, верните ее'
+            self._deadlines.pop(booking_id, None)
+
+        await outbox.send_message(user_id, text)
+
+    async def run(self):
+        """Ожидание ближайшего срабатывания; track и load будят цикл, если появился более ранний срок"""
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            if self._heap:
+                timeout = max(0.0, (self._heap[0][0] - datetime.now()).total_seconds())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            now = datetime.now()
+            while self._heap and self._heap[0][0] <= now:
+                _, booking_id, kind, scheduled_deadline = heapq.heappop(self._heap)
+                current = self._deadlines.get(booking_id)
+                if current is None or current[2] != scheduled_deadline:
+                    continue
+                try:
+                    await self._remind(booking_id, kind, scheduled_deadline)
+                except ValueError:
+                    pass
+
+
+reminders = ReminderScheduler()
@@ -0,0 +1,23 @@
+import asyncio
+import logging
+import os
+
+from database.aio import expire_bookings
+from utils.delivery import outbox
+
+# Период проверки просроченных броней в секундах
+EXPIRY_INTERVAL = float(os.getenv("EXPIRY_INTERVAL", 60))
+
+
+async def expire_bookings_loop(interval: float = EXPIRY_INTERVAL):
+    """Периодическая отмена просроченных броней и уведомление пользователей"""
+    while True:
+        try:
+            expired = await expire_bookings()
+            if expired:
+                logging.info("Отменено просроченных броней: %s", len(expired))
+            for user_id, title in expired:
+                await outbox.send_message(user_id, f'Срок брони книги "{title}" истек, бронь отменена')
+        except ValueError:
+            pass
+        await asyncio.sleep(interval)
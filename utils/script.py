@@ -1,6 +1,7 @@
 import csv
-from translate import Translator
 import time
+import logging
+import argparse
 
 # unique_langs = set()
 
@@ -16,8 +17,10 @@ import time
 
 # print(langs)
 
-from database.db import create_book
+from database.db import create_books_bulk, get_author_ids
+from database.migrations import migrate
 from datetime import date
+from itertools import islice
 import random
 
 langs = {
@@ -53,32 +56,61 @@ langs = {
 
 age_limits = [0, 6, 12, 16, 18]
 
-#translator = Translator(to_lang="ru", translator="yandex")
-with open('archive/books.csv', 'r', encoding='utf-8') as csvfile:
-    csvreader = csv.reader(csvfile)
-    next(csvreader)
-    for row in csvreader:
-        language = None
-        if(not(row[6].isdigit() or row[6] == 'language_code')):
-            language = langs[row[6]]
-
-        #print(f'{row[0]} - {row[10].split("/")}')
-        
-        month, day, year = map(int, row[10].split("/"))
-        d = date(year, month, day)
-
-        
-        create_book(title=row[1],
-                    author_names=row[2].split("/"),
-                    average_rating=float(row[3]), 
-                    isbn=row[4], 
-                    isbn13=row[5], 
-                    language=language, 
-                    num_pages=int(row[7]),
-                    ratings_count=int(row[8]), 
-                    pick_up_count=int(row[9]), 
-                    publication_date=d,
-                    publisher=row[11],
-                    count_in_fund=random.randint(1,10),
-                    age_limit=random.choice(age_limits),
-                    )
+def read_books(path: str):
+    """Потоковое чтение CSV: по одной записи книги на строку"""
+    with open(path, 'r', encoding='utf-8') as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader)
+        for row in csvreader:
+            language = None
+            if(not(row[6].isdigit() or row[6] == 'language_code')):
+                language = langs[row[6]]
+
+            month, day, year = map(int, row[10].split("/"))
+            try:
+                d = date(year, month, day)
+            except ValueError:
+                logging.warning("Пропущена книга %s: некорректная дата %s", row[0], row[10])
+                continue
+
+            yield dict(title=row[1],
+                       author_names=row[2].split("/"),
+                       average_rating=float(row[3]),
+                       isbn=row[4],
+                       isbn13=row[5],
+                       language=language,
+                       num_pages=int(row[7]),
+                       ratings_count=int(row[8]),
+                       pick_up_count=int(row[9]),
+                       publication_date=d,
+                       publisher=row[11],
+                       count_in_fund=random.randint(1,10),
+                       age_limit=random.choice(age_limits),
+                       )
+
+
+def import_books(path: str, batch_size: int = 1000):
+    """Загрузка каталога пакетами с коммитом на каждый пакет"""
+    migrate()
+    author_ids = get_author_ids()
+    books = read_books(path)
+    total = 0
+    start = time.perf_counter()
+
+    while batch := list(islice(books, batch_size)):
+        total += create_books_bulk(batch, author_ids)
+        elapsed = time.perf_counter() - start
+        print(f"Загружено {total} книг, {total / elapsed:.0f} строк/с")
+
+    elapsed = time.perf_counter() - start
+    print(f"Итого: {total} книг за {elapsed:.1f} с ({total / max(elapsed, 1e-9):.0f} строк/с)")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пакетная загрузка каталога книг из CSV")
+    parser.add_argument("path", nargs="?", default="archive/books.csv")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    import_books(args.path, args.batch_size)
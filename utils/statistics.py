@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func
+
+from database.models import SessionLocal, Book, Booking
+from utils.math import book_demand, balance_ratio, rank_demands
+
+# Через сколько секунд готовый результат статистики пересчитывается из данных в памяти
+STATISTICS_MAX_AGE = float(os.getenv("STATISTICS_MAX_AGE", 300))
+# Через сколько секунд снимок перечитывается из базы, чтобы учесть изменения, сделанные
+# в обход этого процесса (импорт, скрипты, другой экземпляр бота)
+STATISTICS_RELOAD_INTERVAL = float(os.getenv("STATISTICS_RELOAD_INTERVAL", 3600))
+
+
+class BookStats:
+    __slots__ = ("title", "pick_up_count", "count_in_fund", "publication_date", "last_booking_date")
+
+    def __init__(self, title, pick_up_count, count_in_fund, publication_date, last_booking_date):
+        self.title = title
+        self.pick_up_count = pick_up_count
+        self.count_in_fund = count_in_fund
+        self.publication_date = publication_date
+        self.last_booking_date = last_booking_date
+
+
+class StatisticsSnapshot:
+    """Снимок входных данных статистики по книгам с инкрементальным обновлением"""
+
+    def __init__(self, max_age: float = STATISTICS_MAX_AGE, reload_interval: float = STATISTICS_RELOAD_INTERVAL):
+        self.max_age = max_age
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._books: Optional[Dict[int, BookStats]] = None
+        self._result: Optional[Tuple[int, List[dict], float]] = None
+        self._loaded_at = 0.0
+        self._computed_at = 0.0
+
+    def _load(self) -> Dict[int, BookStats]:
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(Book.id, Book.title, Book.pick_up_count, Book.count_in_fund,
+                       Book.publication_date, func.max(Booking.booking_date))
+                .outerjoin(Booking, Booking.book_id == Book.id)
+                .group_by(Book.id)
+            )
+            books = {book_id: BookStats(*values) for book_id, *values in rows}
+
+            logging.debug("Снимок статистики загружен: %s книг", len(books))
+
+            return books
+        finally:
+            db.close()
+
+    def _compute(self, limit: int) -> Tuple[int, List[dict], float]:
+        now = datetime.now()
+        books = self._books.values()
+
+        demands = rank_demands(
+            [(book.title, book_demand(book.pick_up_count, book.count_in_fund, book.last_booking_date, now)) for book in books],
+            limit,
+        )
+        coefficient = (
+            sum(balance_ratio(book.pick_up_count, book.count_in_fund, book.publication_date, now) for book in books) / len(books)
+            if books else 0.0
+        )
+
+        return limit, demands, coefficient
+
+    def get(self, limit: int = 15) -> Tuple[List[dict], float]:
+        """Топ книг по востребованности и коэффициент баланса фонда.
+
+        Брони этого процесса учитываются сразу, изменения в обход него - не позже reload_interval секунд"""
+        with self._lock:
+            if self._books is None or time.monotonic() - self._loaded_at > self.reload_interval:
+                self._books = self._load()
+                self._loaded_at = time.monotonic()
+                self._result = None
+
+            if (self._result is None or self._result[0] != limit
+                    or time.monotonic() - self._computed_at > self.max_age):
+                self._result = self._compute(limit)
+                self._computed_at = time.monotonic()
+
+            _, demands, coefficient = self._result
+            return demands, coefficient
+
+    def _update(self, book_id: int, **changes):
+        with self._lock:
+            if self._books is None:
+                return
+            book = self._books.get(book_id)
+            if book is None:
+                # Книга появилась после загрузки снимка
+                self._books = None
+                return
+            for name, delta in changes.items():
+                if name == "last_booking_date":
+                    book.last_booking_date = max(filter(None, (book.last_booking_date, delta)))
+                else:
+                    setattr(book, name, getattr(book, name) + delta)
+            # Пересчет из памяти дешевый, поэтому следующий запрос увидит изменение сразу
+            self._result = None
+
+    def booking_created(self, book_id: int, booking_date: datetime):
+        self._update(book_id, count_in_fund=-1, last_booking_date=booking_date)
+
+    def booking_canceled(self, book_id: int):
+        self._update(book_id, count_in_fund=1)
+
+    def booking_returned(self, book_id: int):
+        self._update(book_id, count_in_fund=1, pick_up_count=1)
+
+    def reset(self):
+        """Полная перезагрузка снимка при следующем запросе (добавление, удаление, переименование книг)"""
+        with self._lock:
+            self._books = None
+            self._result = None
+
+
+snapshot = StatisticsSnapshot()
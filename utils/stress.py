@@ -0,0 +1,64 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from sqlalchemy import delete, func, select
+
+from database.backend import is_memory_sqlite
+from database.db import reserve_book
+from database.migrations import migrate
+from database.models import engine, SessionLocal, Book, Booking, User
+
+# Пользователи стресс-теста получают заведомо несуществующие в Telegram ID
+STRESS_USER_ID = -1_000_000
+
+
+def stress_reserve(copies: int, users: int, workers: int) -> bool:
+    """Параллельное бронирование одной книги: успешных броней должно быть ровно copies"""
+    migrate()
+    db = SessionLocal()
+    user_ids = [STRESS_USER_ID - i for i in range(users)]
+    book_id = None
+    try:
+        book = Book(title="stress", publication_date=date.today(), count_in_fund=copies, pick_up_count=0)
+        db.add(book)
+        db.add_all(User(user_id=user_id, fullname="stress", age=18, phone_number=0) for user_id in user_ids)
+        db.commit()
+        book_id = book.id
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda user_id: reserve_book(user_id=user_id, book_id=book_id), user_ids))
+        elapsed = time.perf_counter() - start
+
+        succeeded = sum(1 for booking in results if booking is not None)
+        bookings = db.scalar(select(func.count()).select_from(Booking).where(Booking.book_id == book_id))
+        remaining = db.scalar(select(Book.count_in_fund).where(Book.id == book_id))
+
+        ok = succeeded == bookings == copies and remaining == 0
+        print(f"{users} броней за {elapsed:.2f} с ({users / elapsed:.0f} в с): "
+              f"успешно {succeeded}, в базе {bookings}, осталось копий {remaining} - {'OK' if ok else 'ОШИБКА'}")
+        return ok
+
+    finally:
+        db.rollback()
+        db.execute(delete(Booking).where(Booking.user_id.in_(user_ids)))
+        db.execute(delete(User).where(User.user_id.in_(user_ids)))
+        db.execute(delete(Book).where(Book.id == book_id))
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Стресс-тест конкурентного бронирования")
+    parser.add_argument("--copies", type=int, default=10)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=10)
+    args = parser.parse_args()
+
+    # Все потоки делили бы одно соединение базы в памяти, и конкурентность не проверялась бы
+    if is_memory_sqlite(engine):
+        parser.error("SQLite в памяти не подходит для стресс-теста, укажите файл: DATABASE_URL=sqlite:////tmp/stress.db")
+
+    raise SystemExit(0 if stress_reserve(args.copies, args.users, args.workers) else 1)
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+import os
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import setup_application
+from pydantic import ValidationError
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", 8080))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 8))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 100))
+
+
+class UpdateQueue:
+    """Ограниченная очередь входящих обновлений с фиксированным числом обработчиков"""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = WEBHOOK_WORKERS, maxsize: int = WEBHOOK_QUEUE_SIZE):
+        self.dp = dp
+        self.bot = bot
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def put(self, update: Update):
+        # При заполненной очереди ответ на запрос задерживается, и Telegram сам снижает темп доставки
+        await self.queue.put(update)
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logging.error("Ошибка обработки обновления %s: %s", update.update_id, e)
+            finally:
+                self.queue.task_done()
+
+    async def drain(self):
+        """Дообработка принятых обновлений и остановка обработчиков"""
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def create_app(dp: Dispatcher, bot: Bot, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET,
+               url: str = WEBHOOK_URL) -> web.Application:
+    """aiohttp-приложение для приема обновлений.
+
+    Локальная проверка: POST записанного JSON обновления на path с заголовком
+    X-Telegram-Bot-Api-Secret-Token, если задан secret"""
+    updates = UpdateQueue(dp, bot)
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except (json.JSONDecodeError, ValidationError) as e:
+            logging.warning("Отклонено некорректное обновление: %s", e)
+            return web.Response(status=400)
+        await updates.put(update)
+        return web.Response()
+
+    async def on_startup(app: web.Application):
+        updates.start()
+        if url:
+            await bot.set_webhook(f"{url}{path}", secret_token=secret)
+        logging.info("Вебхук принимает обновления на %s", path)
+
+    async def on_shutdown(app: web.Application):
+        await updates.drain()
+        logging.info("Очередь обновлений обработана")
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.on_startup.append(on_startup)
+    # Очередь дообрабатывается до остановки диспетчера, которую регистрирует setup_application
+    app.on_shutdown.append(on_shutdown)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host: str = WEBAPP_HOST, port: int = WEBAPP_PORT):
+    runner = web.AppRunner(create_app(dp, bot))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()